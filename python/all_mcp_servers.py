@@ -1,23 +1,33 @@
-from pathlib import Path
 from fastmcp import FastMCP
-from fastmcp.client.transports import StdioTransport
+from starlette.requests import Request
+from starlette.responses import JSONResponse
 from .diffusers import diffusers_mcp
+from .jobs import jobs_mcp, start_job_worker
+from .models import models_mcp, readiness, start_preload
+from .node_pool import NodeProxy, node_pool
 
 mcp = FastMCP("maki composed server")
 all_mcp = mcp
 
 # Mount Stable Diffusion MCP
 mcp.mount(diffusers_mcp)
-# Mount Node.js MCP
-# Assumes you have `node` installed with native TypeScript support (Node 20+).
-mcp.mount(
-    FastMCP.as_proxy(
-        StdioTransport(
-            command="node",
-            args=[str(Path(__file__).parent.parent / "src" / "server.ts")],
-        )
+# Mount model management MCP
+mcp.mount(models_mcp)
+# Mount job queue MCP
+mcp.mount(jobs_mcp)
+# Mount Node.js MCP, spread over a pool of Node processes
+mcp.mount(NodeProxy(node_pool))
+
+
+@mcp.custom_route("/ready", methods=["GET"])
+async def ready(_request: Request) -> JSONResponse:
+    """Readiness probe. Only succeeds once the models in `MAKI_PRELOAD` are loaded and warm."""
+    return JSONResponse(
+        readiness.model_dump(), status_code=200 if readiness.ready else 503
     )
-)
+
 
 if __name__ == "__main__":
+    start_preload()
+    start_job_worker()
     mcp.run()
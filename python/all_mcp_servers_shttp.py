@@ -1,10 +1,14 @@
 from .all_mcp_servers import all_mcp
+from .jobs import start_job_worker
+from .models import start_preload
 
 import uvicorn
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
 
 if __name__ == "__main__":
+    start_preload()
+    start_job_worker()
     http_app = all_mcp.http_app(
         middleware=[
             Middleware(
@@ -0,0 +1,123 @@
+"""
+Measures the overhead of calling the Node tools through the Python MCP server.
+
+Runs the same tool call against the Node MCP server directly, through the single-process
+stdio proxy (`FastMCP.as_proxy`), and through the worker pool, each mounted on a composed
+server the way `all_mcp_servers` mounts it. Prints one JSON line per mode.
+
+    python -m python.bench_node_bridge --calls 500 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Tuple
+
+from fastmcp import FastMCP
+from fastmcp.client import Client
+from pydantic import BaseModel
+
+from .node_pool import NODE_WORKERS, NodeProxy, NodeWorkerPool, node_transport
+
+type Mode = Literal["direct", "proxy", "pool"]
+MODES: Tuple[Mode, ...] = ("direct", "proxy", "pool")
+
+
+class BenchmarkResult(BaseModel):
+    mode: Mode
+    calls: int
+    concurrency: int
+    seconds: float
+    calls_per_second: float
+    mean_latency_ms: float
+    p95_latency_ms: float
+
+
+async def _measure(
+    mode: Mode,
+    call: Callable[[], Awaitable[object]],
+    calls: int,
+    concurrency: int,
+) -> BenchmarkResult:
+    # Not timed: starts the Node processes and sessions.
+    await call()
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed_call() -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed_call() for _ in range(calls)))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return BenchmarkResult(
+        mode=mode,
+        calls=calls,
+        concurrency=concurrency,
+        seconds=seconds,
+        calls_per_second=calls / seconds,
+        mean_latency_ms=1000 * sum(latencies) / len(latencies),
+        p95_latency_ms=1000 * latencies[int(0.95 * (len(latencies) - 1))],
+    )
+
+
+async def benchmark(
+    mode: Mode,
+    tool: str,
+    arguments: Dict[str, Any],
+    calls: int,
+    concurrency: int,
+    workers: int,
+) -> BenchmarkResult:
+    pool: NodeWorkerPool | None = None
+    if mode == "direct":
+        client = Client(node_transport())
+    else:
+        server = FastMCP("bench_node_bridge")
+        if mode == "proxy":
+            server.mount(FastMCP.as_proxy(node_transport()))
+        else:
+            pool = NodeWorkerPool(workers)
+            server.mount(NodeProxy(pool))
+        client = Client(server)
+    try:
+        async with client:
+            return await _measure(
+                mode,
+                lambda: client.call_tool_mcp(name=tool, arguments=arguments),
+                calls,
+                concurrency,
+            )
+    finally:
+        if pool is not None:
+            await pool.close()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tool", default="schema-const")
+    parser.add_argument("--arguments", default='{"value": 1}', help="JSON object")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=NODE_WORKERS)
+    parser.add_argument("--mode", choices=MODES, action="append")
+    options = parser.parse_args()
+    for mode in options.mode or MODES:
+        result = await benchmark(
+            mode,
+            options.tool,
+            json.loads(options.arguments),
+            options.calls,
+            options.concurrency,
+            options.workers,
+        )
+        print(result.model_dump_json())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
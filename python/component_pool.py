@@ -0,0 +1,140 @@
+import copy
+import hashlib
+import json
+import threading
+import weakref
+from typing import Any, Dict, Tuple
+
+import torch
+from torch.nn import Module
+
+from .quantization import QUANTIZED_COMPONENTS, Quantization, module_bytes
+
+# Components that are often byte-identical across fine-tunes of the same base model.
+# Denoisers are not fingerprinted: they almost never match, and hashing them is slow.
+SHARED_COMPONENTS = ("vae", "text_encoder", "text_encoder_2", "text_encoder_3")
+
+
+# Elements of each weight that go into a fingerprint. Fine-tuning changes nearly every
+# element, so a strided sample tells checkpoints apart without reading gigabytes of weights.
+SAMPLED_ELEMENTS = 1024
+
+
+def _config(module: Module) -> Dict[str, Any]:
+    """The module's architecture config, without bookkeeping such as where it was loaded from."""
+    config: Any = getattr(module, "config", None)
+    if config is None:
+        return {}
+    values: Dict[str, Any] = (
+        config.to_dict() if hasattr(config, "to_dict") else dict(config)
+    )
+    return {
+        key: value
+        for key, value in values.items()
+        if not key.startswith("_") and not key.endswith("_version")
+    }
+
+
+def fingerprint(module: Module, name: str, quantization: Quantization | None) -> str:
+    """
+    A hash of the module's class, config and a sample of its weights.
+    The quantization mode is part of it for components that get quantized, since it changes
+    what ends up resident.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(type(module).__qualname__.encode())
+    digest.update(json.dumps(_config(module), sort_keys=True, default=str).encode())
+    if name in QUANTIZED_COMPONENTS:
+        digest.update(str(quantization).encode())
+    for key, tensor in sorted(module.state_dict().items()):
+        digest.update(key.encode())
+        digest.update(str(tensor.dtype).encode())
+        digest.update(str(tuple(tensor.shape)).encode())
+        flat = tensor.detach().reshape(-1)
+        sample = flat[:: max(1, flat.numel() // SAMPLED_ELEMENTS)][:SAMPLED_ELEMENTS]
+        data = sample.cpu().contiguous().view(torch.uint8)
+        digest.update(memoryview(data.numpy()))
+    return digest.hexdigest()
+
+
+class ComponentPool:
+    """Refcounted components, keyed by fingerprint, so identical weights are resident once."""
+
+    def __init__(self) -> None:
+        self._components: Dict[str, Tuple[Module, int]] = {}
+        self._lock = threading.Lock()
+        self._module_locks: weakref.WeakKeyDictionary[Module, threading.Lock] = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def acquire(self, key: str) -> Module | None:
+        """Returns the pooled component for `key` with its refcount incremented, if any."""
+        with self._lock:
+            entry = self._components.get(key)
+            if entry is None:
+                return None
+            module, refcount = entry
+            self._components[key] = (module, refcount + 1)
+            return module
+
+    def add(self, key: str, module: Module) -> Module:
+        """
+        Pools `module` under `key` and returns it, or if a component was pooled under `key`
+        since it was last looked up, acquires and returns that one instead.
+        """
+        with self._lock:
+            entry = self._components.get(key)
+            if entry is not None:
+                module, refcount = entry
+                self._components[key] = (module, refcount + 1)
+                return module
+            self._components[key] = (module, 1)
+            return module
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            module, refcount = self._components[key]
+            if refcount <= 1:
+                del self._components[key]
+            else:
+                self._components[key] = (module, refcount - 1)
+
+    def withdraw(self, key: str) -> Module:
+        """
+        Takes a component out of the pool for private use. If other models still use it,
+        they keep the pooled one and a copy is returned.
+        The copy is made under the pool lock, so no other model can withdraw the component and
+        change it in place while it is being copied.
+        """
+        with self._lock:
+            module, refcount = self._components[key]
+            if refcount <= 1:
+                del self._components[key]
+                return module
+            self._components[key] = (module, refcount - 1)
+            return copy.deepcopy(module)
+
+    def refcount(self, key: str) -> int:
+        with self._lock:
+            entry = self._components.get(key)
+            return 0 if entry is None else entry[1]
+
+    def lock(self, module: Module) -> threading.Lock:
+        """
+        The lock to hold while using `module` in a way that changes it, e.g. casting it to
+        another dtype. Pooled modules are shared by resident models that hold different model
+        locks, so they need one of their own.
+        """
+        with self._lock:
+            lock = self._module_locks.get(module)
+            if lock is None:
+                lock = self._module_locks[module] = threading.Lock()
+            return lock
+
+    def total_bytes(self) -> int:
+        """Bytes taken up by pooled components, each counted once however often it is shared."""
+        with self._lock:
+            return sum(module_bytes(module) for module, _ in self._components.values())
+
+
+component_pool = ComponentPool()
@@ -1,10 +1,35 @@
+import asyncio
+import functools
+import inspect
 from typing import Any, List, Dict, Tuple
 
 from .core import assert_unchecked
+from .guidance import INPAINT_CALLBACK_INPUTS, GuidanceStats, guidance_truncation
+from .inpaint import CropToMask, native_resolution
+from .lora import LoraAdapter
+from .pipelines import (
+    IMAGE_TO_IMAGE_PIPELINES,
+    PipelineFamily,
+    TEXT_TO_IMAGE_PIPELINES,
+    load_pipeline,
+    locked_vae,
+)
+from .stages import StagedDecode
+from .step_cache import StepCache, StepCacheStats, step_caching
+from .sweep import (
+    SweepPoint,
+    encode_prompt,
+    generators,
+    repeat_embeds,
+    sweep_batches,
+)
+from .tiled import TiledFamily, tiled_image_to_image, upscale
+from .quantization import Quantization, image_psnr, pipeline_footprint
 from .pydantic_types import GeneratorType, TensorType, FloatTensorType, ImageType
 import torch
 from PIL.Image import Image
-from fastmcp import FastMCP
+from fastmcp import Context, FastMCP
+from pydantic import BaseModel
 
 from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion import (
     StableDiffusionPipeline,
@@ -61,6 +86,14 @@ mcp = FastMCP("diffusers")
 diffusers_mcp = mcp
 
 
+class GenerationResult(BaseModel):
+    """An image, along with stats about the optimizations that were used to generate it."""
+
+    image: ImageType
+    step_cache: StepCacheStats | None = None
+    guidance: GuidanceStats | None = None
+
+
 @mcp.tool
 def stable_diffusion_text_to_image(
     model_id_or_path: str,
@@ -85,40 +118,65 @@ def stable_diffusion_text_to_image(
     cross_attention_kwargs: Dict[str, Any] | None = None,
     guidance_rescale: float = 0,
     clip_skip: int | None = None,
-) -> ImageType:
+    cfg_end: float | None = None,
+    cfg_convergence_threshold: float | None = None,
+    lora: List[LoraAdapter] | None = None,
+    fuse_lora: bool = False,
+    quantization: Quantization | None = None,
+) -> ImageType | GenerationResult:
     """Generate an image from a prompt using Stable Diffusion"""
-    pipeline = StableDiffusionPipeline.from_pretrained(  # pyright: ignore[reportUnknownMemberType]
-        model_id_or_path, torch_dtype=torch.float16
-    ).to("cuda")
-    result = pipeline(
-        prompt=prompt,
-        height=height,
-        width=width,
-        num_inference_steps=num_inference_steps,
-        timesteps=assert_unchecked(timesteps),
-        sigmas=assert_unchecked(sigmas),
-        guidance_scale=guidance_scale,
-        negative_prompt=negative_prompt,
-        num_images_per_prompt=num_images_per_prompt,
-        eta=eta,
-        generator=generator,
-        latents=latents,
-        prompt_embeds=prompt_embeds,
-        negative_prompt_embeds=negative_prompt_embeds,
-        ip_adapter_image=ip_adapter_image,
-        ip_adapter_image_embeds=ip_adapter_image_embeds,
-        output_type=output_type,
-        return_dict=return_dict,
-        cross_attention_kwargs=cross_attention_kwargs,
-        guidance_rescale=guidance_rescale,
-        clip_skip=clip_skip,
-    )
+    with load_pipeline(
+        StableDiffusionPipeline,
+        model_id_or_path,
+        torch.float16,
+        lora=lora,
+        fuse_lora=fuse_lora,
+        quantization=quantization,
+    ) as pipeline:
+        staged_decode = StagedDecode.create(pipeline, output_type)
+        with (
+            locked_vae(pipeline, staged_decode is None),
+            guidance_truncation(pipeline, cfg_end, cfg_convergence_threshold) as (
+                guidance_stats,
+                guidance_callback,
+            ),
+        ):
+            result = pipeline(
+                prompt=prompt,
+                height=height,
+                width=width,
+                num_inference_steps=num_inference_steps,
+                timesteps=assert_unchecked(timesteps),
+                sigmas=assert_unchecked(sigmas),
+                guidance_scale=guidance_scale,
+                negative_prompt=negative_prompt,
+                num_images_per_prompt=num_images_per_prompt,
+                eta=eta,
+                generator=generator,
+                latents=latents,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                ip_adapter_image=ip_adapter_image,
+                ip_adapter_image_embeds=ip_adapter_image_embeds,
+                output_type=output_type if staged_decode is None else "latent",
+                return_dict=return_dict,
+                cross_attention_kwargs=cross_attention_kwargs,
+                guidance_rescale=guidance_rescale,
+                clip_skip=clip_skip,
+                callback_on_step_end=guidance_callback,
+            )
+    images: Any
     if isinstance(result, StableDiffusionPipelineOutput):
-        image = result.images[0]
+        images = result.images
     else:
-        image = result[0]
+        images = result[0]
+    if staged_decode is not None:
+        images = staged_decode.decode(images, generator)
+    image = images[0]
     if not isinstance(image, Image):
         raise ValueError("Expected image to be a PIL Image")
+    if guidance_stats is not None:
+        return GenerationResult(image=image, guidance=guidance_stats)
     return image
 
 
@@ -144,38 +202,63 @@ def stable_diffusion_image_to_image(
     return_dict: bool = True,
     cross_attention_kwargs: Dict[str, Any] | None = None,
     clip_skip: int | None = None,
-) -> ImageType:
+    cfg_end: float | None = None,
+    cfg_convergence_threshold: float | None = None,
+    lora: List[LoraAdapter] | None = None,
+    fuse_lora: bool = False,
+    quantization: Quantization | None = None,
+) -> ImageType | GenerationResult:
     """Generate an image from a prompt and input image using Stable Diffusion"""
-    pipeline = StableDiffusionImg2ImgPipeline.from_pretrained(  # pyright: ignore[reportUnknownMemberType]
-        model_id_or_path, torch_dtype=torch.float16
-    ).to("cuda")
-    result = pipeline(
-        prompt=prompt,
-        image=image,
-        strength=strength,
-        num_inference_steps=num_inference_steps,
-        timesteps=assert_unchecked(timesteps),
-        sigmas=assert_unchecked(sigmas),
-        guidance_scale=guidance_scale,
-        negative_prompt=negative_prompt,
-        num_images_per_prompt=num_images_per_prompt,
-        eta=eta,
-        generator=generator,
-        prompt_embeds=prompt_embeds,
-        negative_prompt_embeds=negative_prompt_embeds,
-        ip_adapter_image=ip_adapter_image,
-        ip_adapter_image_embeds=ip_adapter_image_embeds,
-        output_type=output_type,
-        return_dict=return_dict,
-        cross_attention_kwargs=cross_attention_kwargs,
-        clip_skip=assert_unchecked(clip_skip),
-    )
+    with load_pipeline(
+        StableDiffusionImg2ImgPipeline,
+        model_id_or_path,
+        torch.float16,
+        lora=lora,
+        fuse_lora=fuse_lora,
+        quantization=quantization,
+    ) as pipeline:
+        staged_decode = StagedDecode.create(pipeline, output_type)
+        with (
+            locked_vae(pipeline),
+            guidance_truncation(pipeline, cfg_end, cfg_convergence_threshold) as (
+                guidance_stats,
+                guidance_callback,
+            ),
+        ):
+            result = pipeline(
+                prompt=prompt,
+                image=image,
+                strength=strength,
+                num_inference_steps=num_inference_steps,
+                timesteps=assert_unchecked(timesteps),
+                sigmas=assert_unchecked(sigmas),
+                guidance_scale=guidance_scale,
+                negative_prompt=negative_prompt,
+                num_images_per_prompt=num_images_per_prompt,
+                eta=eta,
+                generator=generator,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                ip_adapter_image=ip_adapter_image,
+                ip_adapter_image_embeds=ip_adapter_image_embeds,
+                output_type=output_type if staged_decode is None else "latent",
+                return_dict=return_dict,
+                cross_attention_kwargs=cross_attention_kwargs,
+                clip_skip=assert_unchecked(clip_skip),
+                callback_on_step_end=guidance_callback,
+            )
+    images: Any
     if isinstance(result, StableDiffusionPipelineOutput):
-        output_image = result.images[0]
+        images = result.images
     else:
-        output_image = result[0]
+        images = result[0]
+    if staged_decode is not None:
+        images = staged_decode.decode(images, generator)
+    output_image = images[0]
     if not isinstance(output_image, Image):
         raise ValueError("Expected image to be a PIL Image")
+    if guidance_stats is not None:
+        return GenerationResult(image=output_image, guidance=guidance_stats)
     return output_image
 
 
@@ -207,44 +290,91 @@ def stable_diffusion_inpaint(
     return_dict: bool = True,
     cross_attention_kwargs: Dict[str, Any] | None = None,
     clip_skip: int | None = None,
-) -> ImageType:
+    cfg_end: float | None = None,
+    cfg_convergence_threshold: float | None = None,
+    auto_crop: bool = False,
+    auto_crop_padding: int = 32,
+    lora: List[LoraAdapter] | None = None,
+    fuse_lora: bool = False,
+    quantization: Quantization | None = None,
+) -> ImageType | GenerationResult:
     """Inpaint an image using Stable Diffusion"""
-    pipeline = StableDiffusionInpaintPipeline.from_pretrained(  # pyright: ignore[reportUnknownMemberType]
-        model_id_or_path, torch_dtype=torch.float16
-    ).to("cuda")
-    result = pipeline(
-        prompt=prompt,
-        image=image,
-        mask_image=mask_image,
-        masked_image_latents=assert_unchecked(masked_image_latents),
-        height=height,
-        width=width,
-        padding_mask_crop=padding_mask_crop,
-        strength=strength,
-        num_inference_steps=num_inference_steps,
-        timesteps=assert_unchecked(timesteps),
-        sigmas=assert_unchecked(sigmas),
-        guidance_scale=guidance_scale,
-        negative_prompt=negative_prompt,
-        num_images_per_prompt=num_images_per_prompt,
-        eta=eta,
-        generator=generator,
-        latents=latents,
-        prompt_embeds=prompt_embeds,
-        negative_prompt_embeds=negative_prompt_embeds,
-        ip_adapter_image=ip_adapter_image,
-        ip_adapter_image_embeds=ip_adapter_image_embeds,
-        output_type=output_type,
-        return_dict=return_dict,
-        cross_attention_kwargs=cross_attention_kwargs,
-        clip_skip=assert_unchecked(clip_skip),
-    )
+    with load_pipeline(
+        StableDiffusionInpaintPipeline,
+        model_id_or_path,
+        torch.float16,
+        lora=lora,
+        fuse_lora=fuse_lora,
+        quantization=quantization,
+    ) as pipeline:
+        crop = (
+            CropToMask.create(image, mask_image, auto_crop_padding, pipeline)
+            if auto_crop
+            else None
+        )
+        if crop is not None:
+            crop.check_arguments(
+                num_images_per_prompt,
+                output_type,
+                masked_image_latents=masked_image_latents,
+                latents=latents,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+            )
+            image, mask_image = crop.images, crop.masks  # pyright: ignore[reportAssignmentType]
+            prompt = crop.batch(prompt)
+            negative_prompt = crop.batch(negative_prompt)
+            height = width = crop.size
+            padding_mask_crop = None
+        staged_decode = StagedDecode.create(pipeline, output_type, padding_mask_crop)
+        with (
+            locked_vae(pipeline),
+            guidance_truncation(pipeline, cfg_end, cfg_convergence_threshold) as (
+                guidance_stats,
+                guidance_callback,
+            ),
+        ):
+            result = pipeline(
+                prompt=prompt,
+                image=image,
+                mask_image=mask_image,
+                masked_image_latents=assert_unchecked(masked_image_latents),
+                height=height,
+                width=width,
+                padding_mask_crop=padding_mask_crop,
+                strength=strength,
+                num_inference_steps=num_inference_steps,
+                timesteps=assert_unchecked(timesteps),
+                sigmas=assert_unchecked(sigmas),
+                guidance_scale=guidance_scale,
+                negative_prompt=negative_prompt,
+                num_images_per_prompt=num_images_per_prompt,
+                eta=eta,
+                generator=generator,
+                latents=latents,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                ip_adapter_image=ip_adapter_image,
+                ip_adapter_image_embeds=ip_adapter_image_embeds,
+                output_type=output_type if staged_decode is None else "latent",
+                return_dict=return_dict,
+                cross_attention_kwargs=cross_attention_kwargs,
+                clip_skip=assert_unchecked(clip_skip),
+                callback_on_step_end=guidance_callback,
+                callback_on_step_end_tensor_inputs=INPAINT_CALLBACK_INPUTS,
+            )
+    output_images: Any
     if isinstance(result, StableDiffusionPipelineOutput):
-        output_image = result.images[0]
+        output_images = result.images
     else:
-        output_image = result[0]
+        output_images = result[0]
+    if staged_decode is not None:
+        output_images = staged_decode.decode(output_images, generator)
+    output_image = output_images[0] if crop is None else crop.paste(output_images)
     if not isinstance(output_image, Image):
         raise ValueError("Expected image to be a PIL Image")
+    if guidance_stats is not None:
+        return GenerationResult(image=output_image, guidance=guidance_stats)
     return output_image
 
 
@@ -283,51 +413,76 @@ def stable_diffusion_xl_text_to_image(
     negative_crops_coords_top_left: Tuple[int, int] = (0, 0),
     negative_target_size: Tuple[int, int] | None = None,
     clip_skip: int | None = None,
-) -> ImageType:
+    cfg_end: float | None = None,
+    cfg_convergence_threshold: float | None = None,
+    lora: List[LoraAdapter] | None = None,
+    fuse_lora: bool = False,
+    quantization: Quantization | None = None,
+) -> ImageType | GenerationResult:
     """Generate an image from a prompt using Stable Diffusion XL"""
-    pipeline = StableDiffusionXLPipeline.from_pretrained(  # pyright: ignore[reportUnknownMemberType]
-        model_id_or_path, torch_dtype=torch.float16
-    ).to("cuda")
-    result = pipeline(  # pyright: ignore[reportUnknownVariableType]
-        prompt=prompt,
-        prompt_2=prompt_2,
-        height=height,
-        width=width,
-        num_inference_steps=num_inference_steps,
-        timesteps=assert_unchecked(timesteps),
-        sigmas=assert_unchecked(sigmas),
-        denoising_end=denoising_end,
-        guidance_scale=guidance_scale,
-        negative_prompt=negative_prompt,
-        negative_prompt_2=negative_prompt_2,
-        num_images_per_prompt=num_images_per_prompt,
-        eta=eta,
-        generator=generator,
-        latents=latents,
-        prompt_embeds=prompt_embeds,
-        negative_prompt_embeds=negative_prompt_embeds,
-        pooled_prompt_embeds=pooled_prompt_embeds,
-        negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-        ip_adapter_image=ip_adapter_image,
-        ip_adapter_image_embeds=ip_adapter_image_embeds,
-        output_type=output_type,
-        return_dict=return_dict,
-        cross_attention_kwargs=cross_attention_kwargs,
-        guidance_rescale=guidance_rescale,
-        original_size=original_size,
-        crops_coords_top_left=crops_coords_top_left,
-        target_size=target_size,
-        negative_original_size=negative_original_size,
-        negative_crops_coords_top_left=negative_crops_coords_top_left,
-        negative_target_size=negative_target_size,
-        clip_skip=clip_skip,
-    )
+    with load_pipeline(
+        StableDiffusionXLPipeline,
+        model_id_or_path,
+        torch.float16,
+        lora=lora,
+        fuse_lora=fuse_lora,
+        quantization=quantization,
+    ) as pipeline:
+        staged_decode = StagedDecode.create(pipeline, output_type)
+        with (
+            locked_vae(pipeline, staged_decode is None),
+            guidance_truncation(pipeline, cfg_end, cfg_convergence_threshold) as (
+                guidance_stats,
+                guidance_callback,
+            ),
+        ):
+            result = pipeline(  # pyright: ignore[reportUnknownVariableType]
+                prompt=prompt,
+                prompt_2=prompt_2,
+                height=height,
+                width=width,
+                num_inference_steps=num_inference_steps,
+                timesteps=assert_unchecked(timesteps),
+                sigmas=assert_unchecked(sigmas),
+                denoising_end=denoising_end,
+                guidance_scale=guidance_scale,
+                negative_prompt=negative_prompt,
+                negative_prompt_2=negative_prompt_2,
+                num_images_per_prompt=num_images_per_prompt,
+                eta=eta,
+                generator=generator,
+                latents=latents,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                pooled_prompt_embeds=pooled_prompt_embeds,
+                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+                ip_adapter_image=ip_adapter_image,
+                ip_adapter_image_embeds=ip_adapter_image_embeds,
+                output_type=output_type if staged_decode is None else "latent",
+                return_dict=return_dict,
+                cross_attention_kwargs=cross_attention_kwargs,
+                guidance_rescale=guidance_rescale,
+                original_size=original_size,
+                crops_coords_top_left=crops_coords_top_left,
+                target_size=target_size,
+                negative_original_size=negative_original_size,
+                negative_crops_coords_top_left=negative_crops_coords_top_left,
+                negative_target_size=negative_target_size,
+                clip_skip=clip_skip,
+                callback_on_step_end=guidance_callback,
+            )
+    images: Any
     if isinstance(result, StableDiffusionXLPipelineOutput):
-        image = result.images[0]
+        images = result.images
     else:
-        image = result[0]  # pyright: ignore[reportUnknownVariableType]
+        images = result[0]  # pyright: ignore[reportUnknownVariableType]
+    if staged_decode is not None:
+        images = staged_decode.decode(images, generator)
+    image = images[0]  # pyright: ignore[reportUnknownVariableType]
     if not isinstance(image, Image):
         raise ValueError("Expected image to be a PIL Image")
+    if guidance_stats is not None:
+        return GenerationResult(image=image, guidance=guidance_stats)
     return image
 
 
@@ -369,54 +524,79 @@ def stable_diffusion_xl_image_to_image(
     aesthetic_score: float = 6,
     negative_aesthetic_score: float = 2.5,
     clip_skip: int | None = None,
-) -> ImageType:
+    cfg_end: float | None = None,
+    cfg_convergence_threshold: float | None = None,
+    lora: List[LoraAdapter] | None = None,
+    fuse_lora: bool = False,
+    quantization: Quantization | None = None,
+) -> ImageType | GenerationResult:
     """Generate an image from a prompt and input image using Stable Diffusion XL"""
-    pipeline = StableDiffusionXLImg2ImgPipeline.from_pretrained(  # pyright: ignore[reportUnknownMemberType]
-        model_id_or_path, torch_dtype=torch.float16
-    ).to("cuda")
-    result = pipeline(
-        prompt=prompt,
-        image=image,
-        prompt_2=prompt_2,
-        strength=strength,
-        num_inference_steps=num_inference_steps,
-        timesteps=assert_unchecked(timesteps),
-        sigmas=assert_unchecked(sigmas),
-        denoising_start=denoising_start,
-        denoising_end=denoising_end,
-        guidance_scale=guidance_scale,
-        negative_prompt=negative_prompt,
-        negative_prompt_2=negative_prompt_2,
-        num_images_per_prompt=num_images_per_prompt,
-        eta=eta,
-        generator=generator,
-        latents=latents,
-        prompt_embeds=prompt_embeds,
-        negative_prompt_embeds=negative_prompt_embeds,
-        pooled_prompt_embeds=pooled_prompt_embeds,
-        negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-        ip_adapter_image=ip_adapter_image,
-        ip_adapter_image_embeds=ip_adapter_image_embeds,
-        output_type=output_type,
-        return_dict=return_dict,
-        cross_attention_kwargs=cross_attention_kwargs,
-        guidance_rescale=guidance_rescale,
-        original_size=assert_unchecked(original_size),
-        crops_coords_top_left=crops_coords_top_left,
-        target_size=assert_unchecked(target_size),
-        negative_original_size=negative_original_size,
-        negative_crops_coords_top_left=negative_crops_coords_top_left,
-        negative_target_size=negative_target_size,
-        aesthetic_score=aesthetic_score,
-        negative_aesthetic_score=negative_aesthetic_score,
-        clip_skip=clip_skip,
-    )
+    with load_pipeline(
+        StableDiffusionXLImg2ImgPipeline,
+        model_id_or_path,
+        torch.float16,
+        lora=lora,
+        fuse_lora=fuse_lora,
+        quantization=quantization,
+    ) as pipeline:
+        staged_decode = StagedDecode.create(pipeline, output_type)
+        with (
+            locked_vae(pipeline),
+            guidance_truncation(pipeline, cfg_end, cfg_convergence_threshold) as (
+                guidance_stats,
+                guidance_callback,
+            ),
+        ):
+            result = pipeline(
+                prompt=prompt,
+                image=image,
+                prompt_2=prompt_2,
+                strength=strength,
+                num_inference_steps=num_inference_steps,
+                timesteps=assert_unchecked(timesteps),
+                sigmas=assert_unchecked(sigmas),
+                denoising_start=denoising_start,
+                denoising_end=denoising_end,
+                guidance_scale=guidance_scale,
+                negative_prompt=negative_prompt,
+                negative_prompt_2=negative_prompt_2,
+                num_images_per_prompt=num_images_per_prompt,
+                eta=eta,
+                generator=generator,
+                latents=latents,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                pooled_prompt_embeds=pooled_prompt_embeds,
+                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+                ip_adapter_image=ip_adapter_image,
+                ip_adapter_image_embeds=ip_adapter_image_embeds,
+                output_type=output_type if staged_decode is None else "latent",
+                return_dict=return_dict,
+                cross_attention_kwargs=cross_attention_kwargs,
+                guidance_rescale=guidance_rescale,
+                original_size=assert_unchecked(original_size),
+                crops_coords_top_left=crops_coords_top_left,
+                target_size=assert_unchecked(target_size),
+                negative_original_size=negative_original_size,
+                negative_crops_coords_top_left=negative_crops_coords_top_left,
+                negative_target_size=negative_target_size,
+                aesthetic_score=aesthetic_score,
+                negative_aesthetic_score=negative_aesthetic_score,
+                clip_skip=clip_skip,
+                callback_on_step_end=guidance_callback,
+            )
+    images: Any
     if isinstance(result, StableDiffusionXLPipelineOutput):
-        output_image = result.images[0]
+        images = result.images
     else:
-        output_image = result[0]
+        images = result[0]
+    if staged_decode is not None:
+        images = staged_decode.decode(images, generator)
+    output_image = images[0]
     if not isinstance(output_image, Image):
         raise ValueError("Expected image to be a PIL Image")
+    if guidance_stats is not None:
+        return GenerationResult(image=output_image, guidance=guidance_stats)
     return output_image
 
 
@@ -463,59 +643,110 @@ def stable_diffusion_xl_inpaint(
     aesthetic_score: float = 6,
     negative_aesthetic_score: float = 2.5,
     clip_skip: int | None = None,
-) -> ImageType:
+    cfg_end: float | None = None,
+    cfg_convergence_threshold: float | None = None,
+    auto_crop: bool = False,
+    auto_crop_padding: int = 32,
+    lora: List[LoraAdapter] | None = None,
+    fuse_lora: bool = False,
+    quantization: Quantization | None = None,
+) -> ImageType | GenerationResult:
     """Inpaint an image using Stable Diffusion XL"""
-    pipeline = StableDiffusionXLInpaintPipeline.from_pretrained(  # pyright: ignore[reportUnknownMemberType]
-        model_id_or_path, torch_dtype=torch.float16
-    ).to("cuda")
-    result = pipeline(
-        prompt=prompt,
-        prompt_2=prompt_2,
-        image=image,
-        mask_image=mask_image,
-        masked_image_latents=assert_unchecked(masked_image_latents),
-        height=height,
-        width=width,
-        padding_mask_crop=padding_mask_crop,
-        strength=strength,
-        num_inference_steps=num_inference_steps,
-        timesteps=assert_unchecked(timesteps),
-        sigmas=assert_unchecked(sigmas),
-        denoising_start=denoising_start,
-        denoising_end=denoising_end,
-        guidance_scale=guidance_scale,
-        negative_prompt=negative_prompt,
-        negative_prompt_2=negative_prompt_2,
-        num_images_per_prompt=num_images_per_prompt,
-        eta=eta,
-        generator=generator,
-        latents=latents,
-        prompt_embeds=prompt_embeds,
-        negative_prompt_embeds=negative_prompt_embeds,
-        pooled_prompt_embeds=pooled_prompt_embeds,
-        negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-        ip_adapter_image=ip_adapter_image,
-        ip_adapter_image_embeds=ip_adapter_image_embeds,
-        output_type=output_type,
-        return_dict=return_dict,
-        cross_attention_kwargs=cross_attention_kwargs,
-        guidance_rescale=guidance_rescale,
-        original_size=assert_unchecked(original_size),
-        crops_coords_top_left=crops_coords_top_left,
-        target_size=assert_unchecked(target_size),
-        negative_original_size=negative_original_size,
-        negative_crops_coords_top_left=negative_crops_coords_top_left,
-        negative_target_size=negative_target_size,
-        aesthetic_score=aesthetic_score,
-        negative_aesthetic_score=negative_aesthetic_score,
-        clip_skip=clip_skip,
-    )
+    with load_pipeline(
+        StableDiffusionXLInpaintPipeline,
+        model_id_or_path,
+        torch.float16,
+        lora=lora,
+        fuse_lora=fuse_lora,
+        quantization=quantization,
+    ) as pipeline:
+        crop = (
+            CropToMask.create(image, mask_image, auto_crop_padding, pipeline)
+            if auto_crop
+            else None
+        )
+        if crop is not None:
+            crop.check_arguments(
+                num_images_per_prompt,
+                output_type,
+                masked_image_latents=masked_image_latents,
+                latents=latents,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                pooled_prompt_embeds=pooled_prompt_embeds,
+                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+            )
+            image, mask_image = crop.images, crop.masks  # pyright: ignore[reportAssignmentType]
+            prompt = crop.batch(prompt)
+            prompt_2 = crop.batch(prompt_2)
+            negative_prompt = crop.batch(negative_prompt)
+            negative_prompt_2 = crop.batch(negative_prompt_2)
+            height = width = crop.size
+            padding_mask_crop = None
+        staged_decode = StagedDecode.create(pipeline, output_type, padding_mask_crop)
+        with (
+            locked_vae(pipeline),
+            guidance_truncation(pipeline, cfg_end, cfg_convergence_threshold) as (
+                guidance_stats,
+                guidance_callback,
+            ),
+        ):
+            result = pipeline(
+                prompt=prompt,
+                prompt_2=prompt_2,
+                image=image,
+                mask_image=mask_image,
+                masked_image_latents=assert_unchecked(masked_image_latents),
+                height=height,
+                width=width,
+                padding_mask_crop=padding_mask_crop,
+                strength=strength,
+                num_inference_steps=num_inference_steps,
+                timesteps=assert_unchecked(timesteps),
+                sigmas=assert_unchecked(sigmas),
+                denoising_start=denoising_start,
+                denoising_end=denoising_end,
+                guidance_scale=guidance_scale,
+                negative_prompt=negative_prompt,
+                negative_prompt_2=negative_prompt_2,
+                num_images_per_prompt=num_images_per_prompt,
+                eta=eta,
+                generator=generator,
+                latents=latents,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                pooled_prompt_embeds=pooled_prompt_embeds,
+                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+                ip_adapter_image=ip_adapter_image,
+                ip_adapter_image_embeds=ip_adapter_image_embeds,
+                output_type=output_type if staged_decode is None else "latent",
+                return_dict=return_dict,
+                cross_attention_kwargs=cross_attention_kwargs,
+                guidance_rescale=guidance_rescale,
+                original_size=assert_unchecked(original_size),
+                crops_coords_top_left=crops_coords_top_left,
+                target_size=assert_unchecked(target_size),
+                negative_original_size=negative_original_size,
+                negative_crops_coords_top_left=negative_crops_coords_top_left,
+                negative_target_size=negative_target_size,
+                aesthetic_score=aesthetic_score,
+                negative_aesthetic_score=negative_aesthetic_score,
+                clip_skip=clip_skip,
+                callback_on_step_end=guidance_callback,
+                callback_on_step_end_tensor_inputs=INPAINT_CALLBACK_INPUTS,
+            )
+    output_images: Any
     if isinstance(result, StableDiffusionXLPipelineOutput):
-        output_image = result.images[0]
+        output_images = result.images
     else:
-        output_image = result[0]
+        output_images = result[0]
+    if staged_decode is not None:
+        output_images = staged_decode.decode(output_images, generator)
+    output_image = output_images[0] if crop is None else crop.paste(output_images)
     if not isinstance(output_image, Image):
         raise ValueError("Expected image to be a PIL Image")
+    if guidance_stats is not None:
+        return GenerationResult(image=output_image, guidance=guidance_stats)
     return output_image
 
 
@@ -552,49 +783,85 @@ def stable_diffusion_3_text_to_image(
     skip_layer_guidance_stop: float = 0.2,
     skip_layer_guidance_start: float = 0.01,
     mu: float | None = None,
-) -> ImageType:
+    cfg_end: float | None = None,
+    cfg_convergence_threshold: float | None = None,
+    step_cache: StepCache | None = None,
+    step_cache_threshold: float = 0.05,
+    step_cache_skip_range: int = 2,
+    lora: List[LoraAdapter] | None = None,
+    fuse_lora: bool = False,
+    quantization: Quantization | None = None,
+) -> ImageType | GenerationResult:
     """Generate an image from a prompt using Stable Diffusion 3"""
-    pipeline = StableDiffusion3Pipeline.from_pretrained(  # pyright: ignore[reportUnknownMemberType]
-        model_id_or_path, torch_dtype=torch.float16
-    ).to("cuda")
-    result = pipeline(  # pyright: ignore[reportUnknownVariableType]
-        prompt=prompt,
-        prompt_2=prompt_2,
-        prompt_3=prompt_3,
-        height=height,
-        width=width,
-        num_inference_steps=num_inference_steps,
-        sigmas=sigmas,
-        guidance_scale=guidance_scale,
-        negative_prompt=negative_prompt,
-        negative_prompt_2=negative_prompt_2,
-        negative_prompt_3=negative_prompt_3,
-        num_images_per_prompt=num_images_per_prompt,
-        generator=generator,
-        latents=latents,
-        prompt_embeds=prompt_embeds,
-        negative_prompt_embeds=negative_prompt_embeds,
-        pooled_prompt_embeds=pooled_prompt_embeds,
-        negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-        ip_adapter_image=ip_adapter_image,
-        ip_adapter_image_embeds=ip_adapter_image_embeds,
-        output_type=output_type,
-        return_dict=return_dict,
-        joint_attention_kwargs=joint_attention_kwargs,
-        clip_skip=clip_skip,
-        max_sequence_length=max_sequence_length,
-        skip_guidance_layers=assert_unchecked(skip_guidance_layers),
-        skip_layer_guidance_scale=skip_layer_guidance_scale,
-        skip_layer_guidance_stop=skip_layer_guidance_stop,
-        skip_layer_guidance_start=skip_layer_guidance_start,
-        mu=mu,
-    )
+    if step_cache is not None and skip_guidance_layers:
+        # Skip layer guidance makes extra transformer calls, that would share the cache.
+        raise ValueError("`step_cache` cannot be combined with `skip_guidance_layers`")
+    with load_pipeline(
+        StableDiffusion3Pipeline,
+        model_id_or_path,
+        torch.float16,
+        lora=lora,
+        fuse_lora=fuse_lora,
+        quantization=quantization,
+    ) as pipeline:
+        staged_decode = StagedDecode.create(pipeline, output_type)
+        with (
+            locked_vae(pipeline, staged_decode is None),
+            step_caching(
+                pipeline, step_cache, step_cache_threshold, step_cache_skip_range
+            ) as step_cache_stats,
+            guidance_truncation(pipeline, cfg_end, cfg_convergence_threshold) as (
+                guidance_stats,
+                guidance_callback,
+            ),
+        ):
+            result = pipeline(  # pyright: ignore[reportUnknownVariableType]
+                prompt=prompt,
+                prompt_2=prompt_2,
+                prompt_3=prompt_3,
+                height=height,
+                width=width,
+                num_inference_steps=num_inference_steps,
+                sigmas=sigmas,
+                guidance_scale=guidance_scale,
+                negative_prompt=negative_prompt,
+                negative_prompt_2=negative_prompt_2,
+                negative_prompt_3=negative_prompt_3,
+                num_images_per_prompt=num_images_per_prompt,
+                generator=generator,
+                latents=latents,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                pooled_prompt_embeds=pooled_prompt_embeds,
+                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+                ip_adapter_image=ip_adapter_image,
+                ip_adapter_image_embeds=ip_adapter_image_embeds,
+                output_type=output_type if staged_decode is None else "latent",
+                return_dict=return_dict,
+                joint_attention_kwargs=joint_attention_kwargs,
+                clip_skip=clip_skip,
+                max_sequence_length=max_sequence_length,
+                skip_guidance_layers=assert_unchecked(skip_guidance_layers),
+                skip_layer_guidance_scale=skip_layer_guidance_scale,
+                skip_layer_guidance_stop=skip_layer_guidance_stop,
+                skip_layer_guidance_start=skip_layer_guidance_start,
+                mu=mu,
+                callback_on_step_end=guidance_callback,
+            )
+    images: Any
     if isinstance(result, StableDiffusion3PipelineOutput):
-        image = result.images[0]
+        images = result.images
     else:
-        image = result[0]  # pyright: ignore[reportUnknownVariableType]
+        images = result[0]  # pyright: ignore[reportUnknownVariableType]
+    if staged_decode is not None:
+        images = staged_decode.decode(images, generator)
+    image = images[0]  # pyright: ignore[reportUnknownVariableType]
     if not isinstance(image, Image):
         raise ValueError("Expected image to be a PIL Image")
+    if step_cache_stats is not None or guidance_stats is not None:
+        return GenerationResult(
+            image=image, step_cache=step_cache_stats, guidance=guidance_stats
+        )
     return image
 
 
@@ -629,47 +896,80 @@ def stable_diffusion_3_image_to_image(
     clip_skip: int | None = None,
     max_sequence_length: int = 256,
     mu: float | None = None,
-) -> ImageType:
+    cfg_end: float | None = None,
+    cfg_convergence_threshold: float | None = None,
+    step_cache: StepCache | None = None,
+    step_cache_threshold: float = 0.05,
+    step_cache_skip_range: int = 2,
+    lora: List[LoraAdapter] | None = None,
+    fuse_lora: bool = False,
+    quantization: Quantization | None = None,
+) -> ImageType | GenerationResult:
     """Generate an image from a prompt and input image using Stable Diffusion 3"""
-    pipeline = StableDiffusion3Img2ImgPipeline.from_pretrained(  # pyright: ignore[reportUnknownMemberType]
-        model_id_or_path, torch_dtype=torch.float16
-    ).to("cuda")
-    result = pipeline(
-        prompt=prompt,
-        image=image,
-        prompt_2=prompt_2,
-        prompt_3=prompt_3,
-        height=height,
-        width=width,
-        strength=strength,
-        num_inference_steps=num_inference_steps,
-        sigmas=sigmas,
-        guidance_scale=guidance_scale,
-        negative_prompt=negative_prompt,
-        negative_prompt_2=negative_prompt_2,
-        negative_prompt_3=negative_prompt_3,
-        num_images_per_prompt=num_images_per_prompt,
-        generator=generator,
-        latents=latents,
-        prompt_embeds=prompt_embeds,
-        negative_prompt_embeds=negative_prompt_embeds,
-        pooled_prompt_embeds=pooled_prompt_embeds,
-        negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-        output_type=output_type,
-        ip_adapter_image=ip_adapter_image,
-        ip_adapter_image_embeds=ip_adapter_image_embeds,
-        return_dict=return_dict,
-        joint_attention_kwargs=joint_attention_kwargs,
-        clip_skip=clip_skip,
-        max_sequence_length=max_sequence_length,
-        mu=mu,
-    )
-    if isinstance(result, StableDiffusionXLPipelineOutput):
-        output_image = result.images[0]
+    with load_pipeline(
+        StableDiffusion3Img2ImgPipeline,
+        model_id_or_path,
+        torch.float16,
+        lora=lora,
+        fuse_lora=fuse_lora,
+        quantization=quantization,
+    ) as pipeline:
+        staged_decode = StagedDecode.create(pipeline, output_type)
+        with (
+            locked_vae(pipeline),
+            step_caching(
+                pipeline, step_cache, step_cache_threshold, step_cache_skip_range
+            ) as step_cache_stats,
+            guidance_truncation(pipeline, cfg_end, cfg_convergence_threshold) as (
+                guidance_stats,
+                guidance_callback,
+            ),
+        ):
+            result = pipeline(
+                prompt=prompt,
+                image=image,
+                prompt_2=prompt_2,
+                prompt_3=prompt_3,
+                height=height,
+                width=width,
+                strength=strength,
+                num_inference_steps=num_inference_steps,
+                sigmas=sigmas,
+                guidance_scale=guidance_scale,
+                negative_prompt=negative_prompt,
+                negative_prompt_2=negative_prompt_2,
+                negative_prompt_3=negative_prompt_3,
+                num_images_per_prompt=num_images_per_prompt,
+                generator=generator,
+                latents=latents,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                pooled_prompt_embeds=pooled_prompt_embeds,
+                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+                output_type=output_type if staged_decode is None else "latent",
+                ip_adapter_image=ip_adapter_image,
+                ip_adapter_image_embeds=ip_adapter_image_embeds,
+                return_dict=return_dict,
+                joint_attention_kwargs=joint_attention_kwargs,
+                clip_skip=clip_skip,
+                max_sequence_length=max_sequence_length,
+                mu=mu,
+                callback_on_step_end=guidance_callback,
+            )
+    images: Any
+    if isinstance(result, StableDiffusion3PipelineOutput):
+        images = result.images
     else:
-        output_image = result[0]
+        images = result[0]
+    if staged_decode is not None:
+        images = staged_decode.decode(images, generator)
+    output_image = images[0]
     if not isinstance(output_image, Image):
         raise ValueError("Expected image to be a PIL Image")
+    if step_cache_stats is not None or guidance_stats is not None:
+        return GenerationResult(
+            image=output_image, step_cache=step_cache_stats, guidance=guidance_stats
+        )
     return output_image
 
 
@@ -707,53 +1007,105 @@ def stable_diffusion_3_inpaint(
     clip_skip: int | None = None,
     max_sequence_length: int = 256,
     mu: float | None = None,
-) -> ImageType:
+    step_cache: StepCache | None = None,
+    step_cache_threshold: float = 0.05,
+    step_cache_skip_range: int = 2,
+    auto_crop: bool = False,
+    auto_crop_padding: int = 32,
+    lora: List[LoraAdapter] | None = None,
+    fuse_lora: bool = False,
+    quantization: Quantization | None = None,
+) -> ImageType | GenerationResult:
     """Inpaint an image using Stable Diffusion 3"""
-    pipeline = StableDiffusion3InpaintPipeline.from_pretrained(  # pyright: ignore[reportUnknownMemberType]
-        model_id_or_path, torch_dtype=torch.float16
-    ).to("cuda")
-    result = pipeline(
-        prompt=prompt,
-        image=image,
-        mask_image=mask_image,
-        prompt_2=prompt_2,
-        prompt_3=prompt_3,
-        masked_image_latents=assert_unchecked(masked_image_latents),
-        height=assert_unchecked(height),
-        width=assert_unchecked(width),
-        padding_mask_crop=padding_mask_crop,
-        strength=strength,
-        num_inference_steps=num_inference_steps,
-        sigmas=sigmas,
-        guidance_scale=guidance_scale,
-        negative_prompt=negative_prompt,
-        negative_prompt_2=negative_prompt_2,
-        negative_prompt_3=negative_prompt_3,
-        num_images_per_prompt=num_images_per_prompt,
-        generator=generator,
-        latents=latents,
-        prompt_embeds=prompt_embeds,
-        negative_prompt_embeds=negative_prompt_embeds,
-        pooled_prompt_embeds=pooled_prompt_embeds,
-        negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-        ip_adapter_image=ip_adapter_image,
-        ip_adapter_image_embeds=ip_adapter_image_embeds,
-        output_type=output_type,
-        return_dict=return_dict,
-        joint_attention_kwargs=joint_attention_kwargs,
-        clip_skip=clip_skip,
-        max_sequence_length=max_sequence_length,
-        mu=mu,
-    )
+    with load_pipeline(
+        StableDiffusion3InpaintPipeline,
+        model_id_or_path,
+        torch.float16,
+        lora=lora,
+        fuse_lora=fuse_lora,
+        quantization=quantization,
+    ) as pipeline:
+        crop = (
+            CropToMask.create(image, mask_image, auto_crop_padding, pipeline)
+            if auto_crop
+            else None
+        )
+        if crop is not None:
+            crop.check_arguments(
+                num_images_per_prompt,
+                output_type,
+                masked_image_latents=masked_image_latents,
+                latents=latents,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                pooled_prompt_embeds=pooled_prompt_embeds,
+                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+            )
+            image, mask_image = crop.images, crop.masks  # pyright: ignore[reportAssignmentType]
+            prompt = crop.batch(prompt)
+            prompt_2 = crop.batch(prompt_2)
+            prompt_3 = crop.batch(prompt_3)
+            negative_prompt = crop.batch(negative_prompt)
+            negative_prompt_2 = crop.batch(negative_prompt_2)
+            negative_prompt_3 = crop.batch(negative_prompt_3)
+            height = width = crop.size
+            padding_mask_crop = None
+        staged_decode = StagedDecode.create(pipeline, output_type, padding_mask_crop)
+        with (
+            locked_vae(pipeline),
+            step_caching(
+                pipeline, step_cache, step_cache_threshold, step_cache_skip_range
+            ) as step_cache_stats,
+        ):
+            result = pipeline(
+                prompt=prompt,
+                image=image,
+                mask_image=mask_image,
+                prompt_2=prompt_2,
+                prompt_3=prompt_3,
+                masked_image_latents=assert_unchecked(masked_image_latents),
+                height=assert_unchecked(height),
+                width=assert_unchecked(width),
+                padding_mask_crop=padding_mask_crop,
+                strength=strength,
+                num_inference_steps=num_inference_steps,
+                sigmas=sigmas,
+                guidance_scale=guidance_scale,
+                negative_prompt=negative_prompt,
+                negative_prompt_2=negative_prompt_2,
+                negative_prompt_3=negative_prompt_3,
+                num_images_per_prompt=num_images_per_prompt,
+                generator=generator,
+                latents=latents,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                pooled_prompt_embeds=pooled_prompt_embeds,
+                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+                ip_adapter_image=ip_adapter_image,
+                ip_adapter_image_embeds=ip_adapter_image_embeds,
+                output_type=output_type if staged_decode is None else "latent",
+                return_dict=return_dict,
+                joint_attention_kwargs=joint_attention_kwargs,
+                clip_skip=clip_skip,
+                max_sequence_length=max_sequence_length,
+                mu=mu,
+            )
+    output_images: Any
     if isinstance(result, StableDiffusion3PipelineOutput):
-        output_image = result.images[0]
+        output_images = result.images
     else:
-        output_image = result[0]
+        output_images = result[0]
+    if staged_decode is not None:
+        output_images = staged_decode.decode(output_images, generator)
+    output_image = output_images[0] if crop is None else crop.paste(output_images)
     if not isinstance(output_image, Image):
         raise ValueError("Expected image to be a PIL Image")
+    if step_cache_stats is not None:
+        return GenerationResult(image=output_image, step_cache=step_cache_stats)
     return output_image
 
 
+@mcp.tool
 def flux_text_to_image(
     model_id_or_path: str,
     prompt: str | List[str],
@@ -781,46 +1133,284 @@ def flux_text_to_image(
     return_dict: bool = True,
     joint_attention_kwargs: Dict[str, Any] | None = None,
     max_sequence_length: int = 512,
-) -> ImageType:
+    step_cache: StepCache | None = None,
+    step_cache_threshold: float = 0.05,
+    step_cache_skip_range: int = 2,
+    lora: List[LoraAdapter] | None = None,
+    fuse_lora: bool = False,
+    quantization: Quantization | None = None,
+) -> ImageType | GenerationResult:
     """Generate an image from a prompt using FLUX.1 [schnell]"""
-    pipeline = FluxPipeline.from_pretrained(  # pyright: ignore[reportUnknownMemberType]
-        model_id_or_path, torch_dtype=torch.bfloat16
-    ).to("cuda")
-    result = pipeline(  # pyright: ignore[reportUnknownVariableType]
-        prompt=prompt,
-        prompt_2=prompt_2,
-        negative_prompt=assert_unchecked(negative_prompt),
-        negative_prompt_2=negative_prompt_2,
-        true_cfg_scale=true_cfg_scale,
-        height=height,
-        width=width,
-        num_inference_steps=num_inference_steps,
-        sigmas=sigmas,
-        guidance_scale=guidance_scale,
-        num_images_per_prompt=num_images_per_prompt,
-        generator=generator,
-        latents=latents,
-        prompt_embeds=prompt_embeds,
-        pooled_prompt_embeds=pooled_prompt_embeds,
-        ip_adapter_image=ip_adapter_image,
-        ip_adapter_image_embeds=ip_adapter_image_embeds,
-        negative_ip_adapter_image=negative_ip_adapter_image,
-        negative_ip_adapter_image_embeds=negative_ip_adapter_image_embeds,
-        negative_prompt_embeds=negative_prompt_embeds,
-        negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-        output_type=output_type,
-        return_dict=return_dict,
-        joint_attention_kwargs=joint_attention_kwargs,
-        max_sequence_length=max_sequence_length,
-    )
+    with load_pipeline(
+        FluxPipeline,
+        model_id_or_path,
+        torch.bfloat16,
+        lora=lora,
+        fuse_lora=fuse_lora,
+        quantization=quantization,
+    ) as pipeline:
+        with (
+            locked_vae(pipeline),
+            step_caching(
+                pipeline, step_cache, step_cache_threshold, step_cache_skip_range
+            ) as step_cache_stats,
+        ):
+            result = pipeline(  # pyright: ignore[reportUnknownVariableType]
+                prompt=prompt,
+                prompt_2=prompt_2,
+                negative_prompt=assert_unchecked(negative_prompt),
+                negative_prompt_2=negative_prompt_2,
+                true_cfg_scale=true_cfg_scale,
+                height=height,
+                width=width,
+                num_inference_steps=num_inference_steps,
+                sigmas=sigmas,
+                guidance_scale=guidance_scale,
+                num_images_per_prompt=num_images_per_prompt,
+                generator=generator,
+                latents=latents,
+                prompt_embeds=prompt_embeds,
+                pooled_prompt_embeds=pooled_prompt_embeds,
+                ip_adapter_image=ip_adapter_image,
+                ip_adapter_image_embeds=ip_adapter_image_embeds,
+                negative_ip_adapter_image=negative_ip_adapter_image,
+                negative_ip_adapter_image_embeds=negative_ip_adapter_image_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+                output_type=output_type,
+                return_dict=return_dict,
+                joint_attention_kwargs=joint_attention_kwargs,
+                max_sequence_length=max_sequence_length,
+            )
     if isinstance(result, FluxPipelineOutput):
         image = result.images[0]
     else:
         image = result[0]  # pyright: ignore[reportUnknownVariableType]
     if not isinstance(image, Image):
         raise ValueError("Expected image to be a PIL Image")
+    if step_cache_stats is not None:
+        return GenerationResult(image=image, step_cache=step_cache_stats)
     return image
 
 
+class SweepImage(BaseModel):
+    point: SweepPoint
+    image: ImageType
+
+
+@mcp.tool
+async def stable_diffusion_sweep(
+    model_id_or_path: str,
+    family: PipelineFamily,
+    prompt: str,
+    ctx: Context,
+    seeds: List[int],
+    guidance_scales: List[float] | None = None,
+    image: PipelineImageInput | None = None,
+    strengths: List[float] | None = None,
+    negative_prompt: str | None = None,
+    height: int | None = None,
+    width: int | None = None,
+    num_inference_steps: int = 30,
+    max_batch_size: int = 4,
+    lora: List[LoraAdapter] | None = None,
+    fuse_lora: bool = False,
+    quantization: Quantization | None = None,
+) -> List[SweepImage]:
+    """Generate every combination of seeds, guidance scales and strengths, sharing prompt encodings"""
+    if image is None:
+        pipeline_class, torch_dtype = TEXT_TO_IMAGE_PIPELINES[family]
+        if strengths:
+            raise ValueError("`strengths` requires an input `image`")
+    else:
+        if family not in IMAGE_TO_IMAGE_PIPELINES:
+            raise ValueError(f"Image to image sweeps are not supported for {family}")
+        pipeline_class = IMAGE_TO_IMAGE_PIPELINES[family]
+        torch_dtype = TEXT_TO_IMAGE_PIPELINES[family][1]
+    # The model is locked for each call in its thread, never across an `await`: sync tools
+    # run on the event loop, and would block it waiting for the lock.
+    load = functools.partial(
+        load_pipeline,
+        pipeline_class,
+        model_id_or_path,
+        torch_dtype,
+        lora=lora,
+        fuse_lora=fuse_lora,
+        quantization=quantization,
+    )
+
+    def encode() -> Tuple[Dict[str, torch.Tensor], float, torch.device]:
+        pipeline: Any
+        with load() as pipeline:
+            parameters = inspect.signature(pipeline.__call__).parameters
+            return (
+                encode_prompt(pipeline, family, prompt, negative_prompt),
+                parameters["guidance_scale"].default,
+                pipeline._execution_device,
+            )
+
+    def run_batch(kwargs: Dict[str, Any]) -> Any:
+        pipeline: Any
+        with load() as pipeline, locked_vae(pipeline):
+            return pipeline(**kwargs)
+
+    embeds, default_guidance_scale, device = await asyncio.to_thread(encode)
+    batches = list(
+        sweep_batches(
+            seeds,
+            guidance_scales or [default_guidance_scale],
+            [*strengths] if strengths else [None],
+            max_batch_size,
+        )
+    )
+    total = sum(len(batch) for batch in batches)
+    results: List[SweepImage] = []
+    for batch in batches:
+        kwargs: Dict[str, Any] = {
+            **repeat_embeds(embeds, len(batch)),
+            "guidance_scale": batch[0].guidance_scale,
+            "num_inference_steps": num_inference_steps,
+            "generator": generators(device, batch),
+        }
+        if image is None:
+            kwargs.update(height=height, width=width)
+        else:
+            kwargs.update(image=image, strength=assert_unchecked(batch[0].strength))
+        # Run in a thread so progress notifications are sent while the batch denoises.
+        result = await asyncio.to_thread(run_batch, kwargs)
+        for point, output_image in zip(batch, result.images):
+            if not isinstance(output_image, Image):
+                raise ValueError("Expected image to be a PIL Image")
+            results.append(SweepImage(point=point, image=output_image))
+            await ctx.report_progress(len(results), total)
+            await ctx.info(f"Finished image {len(results)}/{total}: {point}")
+    return results
+
+
+@mcp.tool
+def stable_diffusion_tiled_upscale(
+    model_id_or_path: str,
+    family: TiledFamily,
+    prompt: str,
+    image: PipelineImageInput | None = None,
+    scale: float = 2,
+    strength: float = 0.35,
+    num_inference_steps: int = 30,
+    guidance_scale: float = 7,
+    negative_prompt: str | None = None,
+    tile_size: int | None = None,
+    tile_overlap: int = 128,
+    tile_batch_size: int = 4,
+    seed: int = 0,
+    lora: List[LoraAdapter] | None = None,
+    fuse_lora: bool = False,
+    quantization: Quantization | None = None,
+) -> ImageType:
+    """Upscale an image past native resolution by denoising overlapping tiles, generating it first if not given"""
+    text_to_image_class, torch_dtype = TEXT_TO_IMAGE_PIPELINES[family]
+    generator = torch.Generator().manual_seed(seed)
+    if image is None:
+        text_to_image: Any
+        with (
+            load_pipeline(
+                text_to_image_class,
+                model_id_or_path,
+                torch_dtype,
+                lora=lora,
+                fuse_lora=fuse_lora,
+                quantization=quantization,
+            ) as text_to_image,
+            locked_vae(text_to_image),
+        ):
+            image = text_to_image(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                generator=generator,
+            ).images[0]
+    if not isinstance(image, Image):
+        raise ValueError("Expected image to be a PIL Image")
+    with load_pipeline(
+        IMAGE_TO_IMAGE_PIPELINES[family],
+        model_id_or_path,
+        torch_dtype,
+        lora=lora,
+        fuse_lora=fuse_lora,
+        quantization=quantization,
+    ) as pipeline:
+        tile_size = tile_size or native_resolution(pipeline)
+        if not 0 <= tile_overlap < tile_size:
+            raise ValueError(
+                f"`tile_overlap` must be at least 0 and less than `tile_size` ({tile_size})"
+            )
+        return tiled_image_to_image(
+            pipeline,
+            family,
+            upscale(image, scale),
+            prompt,
+            negative_prompt,
+            strength=strength,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            tile_size=tile_size,
+            tile_overlap=tile_overlap,
+            tile_batch_size=tile_batch_size,
+            generator=generator,
+        )
+
+
+class QuantizationReport(BaseModel):
+    quantization: Quantization
+    footprint_bytes: Dict[str, int]
+    reference_footprint_bytes: Dict[str, int]
+    psnr: float
+    """Of the quantized output against the unquantized output, in decibels."""
+    image: ImageType
+    reference_image: ImageType
+
+
+@mcp.tool
+def quantization_quality_check(
+    model_id_or_path: str,
+    family: PipelineFamily,
+    quantization: Quantization,
+    prompt: str,
+    num_inference_steps: int = 20,
+    seed: int = 0,
+) -> QuantizationReport:
+    """Compare the memory footprint and output of a quantized model against the unquantized model"""
+    pipeline_class, torch_dtype = TEXT_TO_IMAGE_PIPELINES[family]
+    images: List[Image] = []
+    footprints: List[Dict[str, int]] = []
+    for mode in (None, quantization):
+        pipeline: Any
+        with (
+            load_pipeline(
+                pipeline_class, model_id_or_path, torch_dtype, quantization=mode
+            ) as pipeline,
+            locked_vae(pipeline),
+        ):
+            result = pipeline(
+                prompt=prompt,
+                num_inference_steps=num_inference_steps,
+                generator=torch.Generator().manual_seed(seed),
+            )
+            footprints.append(pipeline_footprint(pipeline))
+        image = result.images[0]
+        if not isinstance(image, Image):
+            raise ValueError("Expected image to be a PIL Image")
+        images.append(image)
+    reference_image, image = images
+    return QuantizationReport(
+        quantization=quantization,
+        footprint_bytes=footprints[1],
+        reference_footprint_bytes=footprints[0],
+        psnr=image_psnr(image, reference_image),
+        image=image,
+        reference_image=reference_image,
+    )
+
+
 if __name__ == "__main__":
     mcp.run()
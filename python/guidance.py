@@ -0,0 +1,143 @@
+from contextlib import contextmanager
+from typing import Any, Dict, Generator, List, Tuple
+
+import torch
+from pydantic import BaseModel
+from torch import Tensor
+
+
+INPAINT_CALLBACK_INPUTS = ["latents", "mask", "masked_image_latents"]
+"""
+`callback_on_step_end_tensor_inputs` for the inpainting pipelines, which double their mask
+inputs for guidance alongside the latents. The callback halves them when guidance stops.
+Stable Diffusion 3 inpainting does not accept `mask` as a callback input, so it cannot stop
+guidance early and has no options for it.
+"""
+
+
+class GuidanceStats(BaseModel):
+    guided_steps: int
+    """Steps that ran both the conditional and unconditional branch."""
+    total_steps: int
+    last_divergence: float | None = None
+    """Relative difference between the two branches at the last guided step."""
+
+
+def _conditional_half(value: Any, batch_size: int) -> Any:
+    """
+    Drops the unconditional half of doubled conditioning inputs.
+    Pipelines concatenate them as `[unconditional, conditional]`.
+    """
+    if (
+        isinstance(value, Tensor)
+        and value.dim() > 0
+        and value.shape[0] == 2 * batch_size
+    ):
+        return value[batch_size:]
+    if isinstance(value, dict):
+        return {
+            key: _conditional_half(item, batch_size)
+            for key, item in value.items()  # pyright: ignore[reportUnknownVariableType]
+        }
+    if isinstance(value, (list, tuple)):
+        # E.g. IP-Adapter `image_embeds`, one tensor per adapter.
+        items: List[Any] = [
+            _conditional_half(item, batch_size)
+            for item in value  # pyright: ignore[reportUnknownVariableType]
+        ]
+        return items if isinstance(value, list) else tuple(items)
+    return value
+
+
+class _GuidanceState:
+    def __init__(self) -> None:
+        self.truncated = False
+        self.measure = True
+        self.guided_steps = 0
+        self.divergence: float | None = None
+
+
+@contextmanager
+def guidance_truncation(
+    pipeline: Any, end: float | None, convergence_threshold: float | None
+) -> Generator[Tuple[GuidanceStats | None, Any]]:
+    """
+    Stops classifier-free guidance partway through denoising, after which only the
+    conditional branch runs, halving the denoiser's batch.
+    Guidance stops after `end` (a fraction) of the steps, or as soon as the relative
+    difference between the two branches drops below `convergence_threshold`.
+    Yields the stats, filled in when the block exits, and the `callback_on_step_end`
+    to pass to the pipeline (untyped, since diffusers annotates it with the signature of the
+    legacy `callback`). Without either option, this does nothing.
+    """
+    if end is None and convergence_threshold is None:
+        yield None, None
+        return
+    denoiser: torch.nn.Module = (
+        pipeline.unet if hasattr(pipeline, "unet") else pipeline.transformer
+    )
+    state = _GuidanceState()
+
+    def pre_hook(
+        _module: torch.nn.Module, args: Tuple[Any, ...], kwargs: Dict[str, Any]
+    ) -> Tuple[Tuple[Any, ...], Dict[str, Any]]:
+        if not state.truncated:
+            return args, kwargs
+        name = "hidden_states" if "hidden_states" in kwargs else "sample"
+        hidden_states: Tensor = args[0] if args else kwargs[name]
+        batch_size = hidden_states.shape[0]
+        return args, {
+            name: _conditional_half(value, batch_size) for name, value in kwargs.items()
+        }
+
+    def post_hook(_module: torch.nn.Module, _args: Any, output: Any) -> None:
+        # Only the first call of each step is the guided prediction: SD3 may make extra
+        # calls for skip-layer guidance.
+        if state.truncated or not state.measure:
+            return
+        state.measure = False
+        prediction: Tensor = output.sample if hasattr(output, "sample") else output[0]
+        if prediction.shape[0] % 2 != 0:
+            return
+        unconditional, conditional = prediction.float().chunk(2)
+        difference = (conditional - unconditional).square().sum().sqrt()
+        magnitude = conditional.square().sum().sqrt().clamp(min=1e-12)
+        state.divergence = (difference / magnitude).item()
+
+    def callback(
+        pipe: Any, step: int, _timestep: Any, callback_kwargs: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        if state.truncated or not pipe.do_classifier_free_guidance:
+            return callback_kwargs
+        state.guided_steps += 1
+        state.measure = True
+        finished = end is not None and step + 1 >= end * pipe.num_timesteps
+        converged = (
+            convergence_threshold is not None
+            and state.divergence is not None
+            and state.divergence < convergence_threshold
+        )
+        if finished or converged:
+            state.truncated = True
+            # `do_classifier_free_guidance` is derived from this, so the latents stop being doubled.
+            pipe._guidance_scale = 1.0
+            # Inputs the pipeline doubled once up front, such as inpainting masks, are handed
+            # back halved. The latents never are.
+            batch_size = callback_kwargs["latents"].shape[0]
+            return {
+                name: _conditional_half(value, batch_size)
+                for name, value in callback_kwargs.items()
+            }
+        return callback_kwargs
+
+    pre_handle = denoiser.register_forward_pre_hook(pre_hook, with_kwargs=True)
+    post_handle = denoiser.register_forward_hook(post_hook)
+    stats = GuidanceStats(guided_steps=0, total_steps=0)
+    try:
+        yield stats, callback
+    finally:
+        pre_handle.remove()
+        post_handle.remove()
+        stats.guided_steps = state.guided_steps
+        stats.total_steps = getattr(pipeline, "_num_timesteps", 0)
+        stats.last_divergence = state.divergence
@@ -0,0 +1,222 @@
+from typing import Any, List, Tuple, overload
+
+import numpy
+from PIL import ImageFilter
+from PIL.Image import Image, Resampling
+
+type Box = Tuple[int, int, int, int]
+"""`(left, top, right, bottom)`, as used by PIL."""
+
+# Masks are analyzed on a grid of cells this many pixels wide, matching the latent resolution.
+MASK_CELL_SIZE = 8
+
+
+def _components(cells: numpy.ndarray[Any, Any]) -> List[Box]:
+    """Bounding boxes (in cells) of the 4-connected components of a boolean grid."""
+    seen = numpy.zeros_like(cells, dtype=bool)
+    height, width = cells.shape
+    boxes: List[Box] = []
+    for y, x in zip(*numpy.nonzero(cells)):
+        if seen[y, x]:
+            continue
+        seen[y, x] = True
+        stack = [(int(y), int(x))]
+        left, top, right, bottom = int(x), int(y), int(x), int(y)
+        while stack:
+            cy, cx = stack.pop()
+            left, top = min(left, cx), min(top, cy)
+            right, bottom = max(right, cx), max(bottom, cy)
+            for ny, nx in ((cy - 1, cx), (cy + 1, cx), (cy, cx - 1), (cy, cx + 1)):
+                if (
+                    0 <= ny < height
+                    and 0 <= nx < width
+                    and cells[ny, nx]
+                    and not seen[ny, nx]
+                ):
+                    seen[ny, nx] = True
+                    stack.append((ny, nx))
+        boxes.append((left, top, right + 1, bottom + 1))
+    return boxes
+
+
+def _overlaps(a: Box, b: Box) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _merge_overlapping(boxes: List[Box]) -> List[Box]:
+    merged = list(boxes)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                if _overlaps(merged[i], merged[j]):
+                    a, b = merged[i], merged.pop(j)
+                    merged[i] = (
+                        min(a[0], b[0]),
+                        min(a[1], b[1]),
+                        max(a[2], b[2]),
+                        max(a[3], b[3]),
+                    )
+                    changed = True
+                    break
+            if changed:
+                break
+    return merged
+
+
+def _square(box: Box, image_width: int, image_height: int) -> Box | None:
+    """The smallest square crop containing `box`, or `None` if it does not fit in the image."""
+    side = max(box[2] - box[0], box[3] - box[1])
+    if side > min(image_width, image_height):
+        return None
+    left = min(max((box[0] + box[2] - side) // 2, 0), image_width - side)
+    top = min(max((box[1] + box[3] - side) // 2, 0), image_height - side)
+    return (left, top, left + side, top + side)
+
+
+def mask_crops(mask: Image, padding: int) -> List[Box] | None:
+    """
+    Square crops covering each disjoint region of `mask`, with `padding` pixels of context.
+    Returns `None` when cropping would not save any work, in which case the full canvas
+    should be inpainted instead.
+    """
+    width, height = mask.size
+    grid = mask.convert("L").resize(
+        (-(-width // MASK_CELL_SIZE), -(-height // MASK_CELL_SIZE)), Resampling.BOX
+    )
+    cells = numpy.asarray(grid) > 0
+    boxes = [
+        (
+            max(left * MASK_CELL_SIZE - padding, 0),
+            max(top * MASK_CELL_SIZE - padding, 0),
+            min(right * MASK_CELL_SIZE + padding, width),
+            min(bottom * MASK_CELL_SIZE + padding, height),
+        )
+        for left, top, right, bottom in _components(cells)
+    ]
+    if not boxes:
+        return None
+    crops: List[Box] = []
+    # Squaring boxes can make them overlap again, so repeat until it settles.
+    while True:
+        boxes = _merge_overlapping(boxes)
+        squares = [_square(box, width, height) for box in boxes]
+        if any(square is None for square in squares):
+            return None
+        crops = [square for square in squares if square is not None]
+        if crops == boxes:
+            break
+        boxes = crops
+    area = sum((right - left) * (bottom - top) for left, top, right, bottom in crops)
+    if area >= width * height:
+        return None
+    return crops
+
+
+def crop_regions(
+    image: Image, mask: Image, crops: List[Box], size: int
+) -> Tuple[List[Image], List[Image]]:
+    """Crops `image` and `mask` to each region, resized to `size`x`size`."""
+    images = [
+        image.crop(crop).resize((size, size), Resampling.LANCZOS) for crop in crops
+    ]
+    masks = [
+        mask.convert("L").crop(crop).resize((size, size), Resampling.NEAREST)
+        for crop in crops
+    ]
+    return images, masks
+
+
+def paste_regions(
+    image: Image, mask: Image, crops: List[Box], outputs: List[Image], feather: int
+) -> Image:
+    """
+    Pastes each inpainted region back onto `image`.
+    Only masked pixels are replaced, with the mask edge feathered by `feather` pixels
+    so the seam is not visible.
+    """
+    result = image.convert("RGB")
+    blend_mask = mask.convert("L")
+    if feather > 0:
+        blend_mask = blend_mask.filter(ImageFilter.GaussianBlur(feather))
+    for crop, output in zip(crops, outputs):
+        size = (crop[2] - crop[0], crop[3] - crop[1])
+        region = output.convert("RGB").resize(size, Resampling.LANCZOS)
+        result.paste(region, crop[:2], blend_mask.crop(crop))
+    return result
+
+
+class CropToMask:
+    """
+    Inpaints only the masked regions of an image rather than the full canvas.
+    Each region is cropped out, resized to the model's native resolution, and all of them
+    are denoised as one batch before being blended back into the original image.
+    """
+
+    def __init__(
+        self, image: Image, mask: Image, crops: List[Box], size: int, feather: int
+    ) -> None:
+        self.source_image = image
+        self.source_mask = mask
+        self.crops = crops
+        self.size = size
+        self.feather = feather
+        self.images, self.masks = crop_regions(image, mask, crops, size)
+
+    @staticmethod
+    def create(
+        image: Image, mask: Image, padding: int, pipeline: Any
+    ) -> "CropToMask | None":
+        """Returns `None` if cropping would not save any work."""
+        if mask.size != image.size:
+            # Like the pipelines do, so regions found in the mask line up with the image.
+            mask = mask.resize(image.size, Resampling.NEAREST)
+        crops = mask_crops(mask, padding)
+        if crops is None:
+            return None
+        return CropToMask(image, mask, crops, native_resolution(pipeline), padding // 4)
+
+    def check_arguments(
+        self,
+        num_images_per_prompt: int | None,
+        output_type: str | None,
+        **arguments: Any,
+    ) -> None:
+        """Rejects arguments that describe the full canvas, which cannot be cropped."""
+        if num_images_per_prompt not in (None, 1):
+            raise ValueError("`auto_crop` only supports one image per prompt")
+        if output_type != "pil":
+            raise ValueError("`auto_crop` only supports PIL output")
+        for name, value in arguments.items():
+            if value is not None:
+                raise ValueError(f"`auto_crop` does not support `{name}`")
+
+    @overload
+    def batch(self, prompt: str | List[str]) -> List[str]: ...
+    @overload
+    def batch(self, prompt: str | List[str] | None) -> List[str] | None: ...
+    def batch(self, prompt: str | List[str] | None) -> List[str] | None:
+        """Repeats a single prompt for every region in the batch."""
+        if prompt is None:
+            return None
+        if isinstance(prompt, str):
+            return [prompt] * len(self.crops)
+        if len(prompt) == 1:
+            return prompt * len(self.crops)
+        raise ValueError("`auto_crop` only supports a single prompt")
+
+    def paste(self, outputs: List[Any]) -> Image:
+        if not all(isinstance(output, Image) for output in outputs):
+            raise ValueError("Expected image to be a PIL Image")
+        return paste_regions(
+            self.source_image, self.source_mask, self.crops, outputs, self.feather
+        )
+
+
+def native_resolution(pipeline: Any) -> int:
+    """The resolution the denoiser was trained at, in pixels."""
+    sample_size = getattr(pipeline, "default_sample_size", None)
+    if sample_size is None:
+        sample_size = pipeline.unet.config.sample_size
+    return sample_size * pipeline.vae_scale_factor
@@ -0,0 +1,350 @@
+import base64
+import functools
+import inspect
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Literal
+
+import PIL.Image
+from fastmcp import FastMCP
+from PIL.Image import Image
+from pydantic import BaseModel, ConfigDict, create_model
+
+from . import diffusers
+from .diffusers import GenerationResult
+from .pydantic_types import ImageType
+from .stages import JobStages, StageStats
+
+mcp = FastMCP("jobs")
+jobs_mcp = mcp
+
+JOBS_DATABASE = os.environ.get("MAKI_JOBS_DATABASE", "maki_jobs.sqlite3")
+# Whether the next job may start denoising while the previous one is still being decoded.
+PIPELINED_JOBS = os.environ.get("MAKI_PIPELINED_JOBS", "0") == "1"
+
+type JobTool = Literal[
+    "stable_diffusion_text_to_image",
+    "stable_diffusion_image_to_image",
+    "stable_diffusion_inpaint",
+    "stable_diffusion_xl_text_to_image",
+    "stable_diffusion_xl_image_to_image",
+    "stable_diffusion_xl_inpaint",
+    "stable_diffusion_3_text_to_image",
+    "stable_diffusion_3_image_to_image",
+    "stable_diffusion_3_inpaint",
+    "flux_text_to_image",
+]
+type JobStatus = Literal["queued", "running", "succeeded", "failed", "cancelled"]
+
+# Arguments that hold images. They are passed to `submit_job` as base64-encoded image files.
+IMAGE_ARGUMENTS = ("image", "mask_image", "ip_adapter_image")
+
+
+class JobInfo(BaseModel):
+    id: str
+    tool: JobTool
+    status: JobStatus
+    created_at: float
+    started_at: float | None
+    finished_at: float | None
+    error: str | None
+
+
+def encode_image(image: Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def decode_image(data: bytes) -> Image:
+    image = PIL.Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+class JobQueue:
+    """
+    A persistent FIFO of tool calls, backed by SQLite.
+    Jobs that were running when the server stopped are queued again on startup,
+    and finished results are stored, so neither queued nor finished work is lost.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        with self._lock, self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    tool TEXT NOT NULL,
+                    arguments TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    error TEXT,
+                    result_image BLOB,
+                    result_stats TEXT
+                )
+                """
+            )
+            self._connection.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'"
+            )
+
+    def _info(self, row: sqlite3.Row) -> JobInfo:
+        return JobInfo(
+            id=row["id"],
+            tool=row["tool"],
+            status=row["status"],
+            created_at=row["created_at"],
+            started_at=row["started_at"],
+            finished_at=row["finished_at"],
+            error=row["error"],
+        )
+
+    def _row(self, job_id: str) -> sqlite3.Row:
+        row = self._connection.execute(
+            "SELECT * FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"Unknown job {job_id}")
+        return row
+
+    def submit(self, tool: JobTool, arguments: Dict[str, Any]) -> JobInfo:
+        job_id = uuid.uuid4().hex
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO jobs (id, tool, arguments, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, tool, json.dumps(arguments), time.time()),
+            )
+            self._wakeup.notify_all()
+            return self._info(self._row(job_id))
+
+    def get(self, job_id: str) -> JobInfo:
+        with self._lock:
+            return self._info(self._row(job_id))
+
+    def list(self, status: JobStatus | None = None) -> List[JobInfo]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT * FROM jobs WHERE ? IS NULL OR status = ? ORDER BY created_at",
+                (status, status),
+            ).fetchall()
+            return [self._info(row) for row in rows]
+
+    def result(self, job_id: str) -> ImageType | GenerationResult:
+        with self._lock:
+            row = self._row(job_id)
+        if row["status"] != "succeeded":
+            raise ValueError(
+                f"Job {job_id} has not succeeded (status: {row['status']})"
+            )
+        image = decode_image(row["result_image"])
+        if row["result_stats"] is None:
+            return image
+        return GenerationResult(image=image, **json.loads(row["result_stats"]))
+
+    def cancel(self, job_id: str) -> JobInfo:
+        """
+        Cancels a job. A running job cannot be interrupted mid-denoise,
+        but its result is discarded when it finishes.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id),
+            )
+            return self._info(self._row(job_id))
+
+    def take(self) -> sqlite3.Row:
+        """Blocks until a job is queued, then marks the oldest one as running and returns it."""
+        with self._lock:
+            while True:
+                row = self._connection.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    break
+                self._wakeup.wait()
+            with self._connection:
+                self._connection.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+                    (time.time(), row["id"]),
+                )
+            return row
+
+    def finish(
+        self,
+        job_id: str,
+        result: Image | GenerationResult | None = None,
+        error: str | None = None,
+    ) -> None:
+        image: bytes | None = None
+        stats: str | None = None
+        if isinstance(result, GenerationResult):
+            image = encode_image(result.image)
+            stats = result.model_dump_json(exclude={"image"})
+        elif result is not None:
+            image = encode_image(result)
+        with self._lock, self._connection:
+            # A job cancelled while running stays cancelled.
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, error = ?, result_image = ?, result_stats = ? WHERE id = ? AND status = 'running'",
+                (
+                    "failed" if error is not None else "succeeded",
+                    time.time(),
+                    error,
+                    image,
+                    stats,
+                    job_id,
+                ),
+            )
+
+
+def _tool_function(tool: JobTool) -> Callable[..., Any]:
+    # `@mcp.tool` replaces the function with a `FunctionTool`; we want the original.
+    return getattr(diffusers, tool).fn
+
+
+def _decode_arguments(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        name: decode_image(base64.b64decode(value))
+        if name in IMAGE_ARGUMENTS and isinstance(value, str)
+        else value
+        for name, value in arguments.items()
+    }
+
+
+@functools.cache
+def _arguments_model(tool: JobTool) -> type[BaseModel]:
+    """A model of the tool's parameters, so jobs are validated like direct tool calls."""
+    fields: Dict[str, Any] = {
+        name: (
+            parameter.annotation,
+            ... if parameter.default is inspect.Parameter.empty else parameter.default,
+        )
+        for name, parameter in inspect.signature(
+            _tool_function(tool)
+        ).parameters.items()
+    }
+    return create_model(
+        f"{tool}_arguments",
+        __config__=ConfigDict(
+            arbitrary_types_allowed=True, extra="forbid", protected_namespaces=()
+        ),
+        **fields,
+    )
+
+
+def validate_arguments(tool: JobTool, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validates JSON arguments for `tool`, returning them as the tool expects them,
+    e.g. with images decoded and LoRA adapters as `LoraAdapter`s.
+    """
+    validated = _arguments_model(tool).model_validate(_decode_arguments(arguments))
+    return dict(validated)
+
+
+def run_job(row: sqlite3.Row) -> Image | GenerationResult:
+    arguments = validate_arguments(row["tool"], json.loads(row["arguments"]))
+    return _tool_function(row["tool"])(**arguments)
+
+
+def work(queue: JobQueue, stages: JobStages) -> None:
+    while True:
+        with stages.job() as stage:
+            row = queue.take()
+            # Image-to-image and inpainting encode their input with the VAE before denoising.
+            stage.start(encodes_images=not row["tool"].endswith("_text_to_image"))
+            try:
+                result = run_job(row)
+            # What a bad job can cause: invalid arguments (pydantic's `ValidationError` is a
+            # `ValueError`), a checkpoint that cannot be found or read, or running out of device
+            # memory. Anything else is a bug, and stops the worker.
+            except (ValueError, TypeError, OSError, RuntimeError) as error:
+                queue.finish(row["id"], error=repr(error))
+            else:
+                queue.finish(row["id"], result)
+
+
+_job_queue: JobQueue | None = None
+job_stages = JobStages(PIPELINED_JOBS)
+
+
+def job_queue() -> JobQueue:
+    if _job_queue is None:
+        raise RuntimeError("The job worker has not been started")
+    return _job_queue
+
+
+def start_job_worker() -> List[threading.Thread]:
+    """
+    Opens the job database, queueing jobs that were running when the server stopped again,
+    and starts the worker threads.
+    """
+    global _job_queue
+    _job_queue = JobQueue(JOBS_DATABASE)
+    threads = [
+        threading.Thread(
+            target=work,
+            args=(_job_queue, job_stages),
+            name=f"maki-jobs-{index}",
+            daemon=True,
+        )
+        for index in range(job_stages.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+@mcp.tool
+def submit_job(tool: JobTool, arguments: Dict[str, Any]) -> JobInfo:
+    """Queue a call to a diffusion tool and return immediately. Image arguments are base64-encoded image files"""
+    # Rejects invalid arguments now, rather than when the job runs.
+    validate_arguments(tool, arguments)
+    return job_queue().submit(tool, arguments)
+
+
+@mcp.tool
+def job_status(job_id: str) -> JobInfo:
+    """Get the status of a queued job"""
+    return job_queue().get(job_id)
+
+
+@mcp.tool
+def list_jobs(status: JobStatus | None = None) -> List[JobInfo]:
+    """List queued jobs, oldest first"""
+    return job_queue().list(status)
+
+
+@mcp.tool
+def job_result(job_id: str) -> ImageType | GenerationResult:
+    """Get the result of a job that has succeeded"""
+    return job_queue().result(job_id)
+
+
+@mcp.tool
+def cancel_job(job_id: str) -> JobInfo:
+    """Cancel a queued job. Running jobs finish, but their result is discarded"""
+    return job_queue().cancel(job_id)
+
+
+@mcp.tool
+def job_worker_stats() -> StageStats:
+    """Get how busy the job worker's denoise and decode stages have been, and how much they overlapped"""
+    return job_stages.occupancy.stats(job_stages.pipelined)
+
+
+if __name__ == "__main__":
+    start_job_worker()
+    mcp.run()
@@ -0,0 +1,147 @@
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Tuple
+
+import torch
+from pydantic import BaseModel
+from torch import Tensor
+
+# How many adapters may stay loaded on one resident model at a time.
+MAX_LOADED_ADAPTERS = int(os.environ.get("MAKI_MAX_LORA_ADAPTERS", "8"))
+# How many fused weight sets (one per adapter/weight combination) are kept on the CPU.
+MAX_FUSED_COMBINATIONS = int(os.environ.get("MAKI_MAX_FUSED_LORA", "2"))
+
+
+class LoraAdapter(BaseModel):
+    """A LoRA adapter to apply on top of the base checkpoint."""
+
+    id: str
+    """Hugging Face Hub id or local path of the adapter."""
+    weight: float = 1
+    weight_name: str | None = None
+    """Name of the weights file, for repositories containing more than one."""
+
+
+type FusedKey = Tuple[Tuple[str, float], ...]
+
+
+def adapter_name(adapter: LoraAdapter) -> str:
+    """
+    A stable adapter name for `adapter`.
+    `peft` does not allow `.` in adapter names, so we cannot use the id directly.
+    """
+    key = f"{adapter.id}\0{adapter.weight_name or ''}"
+    return "lora_" + hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+class LoraState:
+    """
+    LoRA bookkeeping for one resident model.
+    All pipelines derived from the same checkpoint share their modules, and therefore this state.
+    """
+
+    def __init__(self) -> None:
+        self.loaded: OrderedDict[str, LoraAdapter] = OrderedDict()
+        """Loaded adapters, least recently used first."""
+        self.base_weights: Dict[str, Tensor] = {}
+        """CPU copies of the original weights of every layer LoRA has ever been fused into."""
+        self.fused: OrderedDict[FusedKey, Dict[str, Tensor]] = OrderedDict()
+        """CPU copies of fused weights, least recently used first."""
+        self.active_fused: FusedKey | None = None
+
+
+def _lora_layers(pipeline: Any) -> Iterator[Tuple[str, Any]]:
+    """Yields every `peft` tuner layer in the pipeline, keyed by component and module name."""
+    for component_name, component in pipeline.components.items():
+        if not isinstance(component, torch.nn.Module):
+            continue
+        for module_name, module in component.named_modules():  # pyright: ignore[reportUnknownVariableType]
+            if hasattr(module, "base_layer") and hasattr(module, "merged_adapters"):  # pyright: ignore[reportUnknownArgumentType]
+                yield f"{component_name}.{module_name}", module
+
+
+@torch.no_grad()  # pyright: ignore[reportUntypedFunctionDecorator]
+def _restore_base(pipeline: Any, state: LoraState) -> None:
+    """Copies the original weights back, which (unlike `unfuse_lora`) is bit-exact."""
+    for name, layer in _lora_layers(pipeline):
+        base = state.base_weights.get(name)
+        if base is not None:
+            layer.base_layer.weight.copy_(base)
+    state.active_fused = None
+
+
+@torch.no_grad()  # pyright: ignore[reportUntypedFunctionDecorator]
+def _fuse(pipeline: Any, state: LoraState, names: List[str], key: FusedKey) -> None:
+    cached = state.fused.get(key)
+    layers = list(_lora_layers(pipeline))
+    if cached is None:
+        for name, layer in layers:
+            if name not in state.base_weights:
+                state.base_weights[name] = layer.base_layer.weight.detach().to(
+                    "cpu", copy=True
+                )
+        pipeline.fuse_lora(adapter_names=names)
+        cached = {
+            name: layer.base_layer.weight.detach().to("cpu", copy=True)
+            for name, layer in layers
+        }
+        # We own restoring the weights from now on. If `peft` still thought the layers
+        # were merged, it would try to unmerge them (lossily) on the next forward pass.
+        for _, layer in layers:
+            layer.merged_adapters.clear()
+        state.fused[key] = cached
+        while len(state.fused) > MAX_FUSED_COMBINATIONS:
+            state.fused.popitem(last=False)
+    else:
+        state.fused.move_to_end(key)
+        for name, layer in layers:
+            weight = cached.get(name)
+            if weight is not None:
+                layer.base_layer.weight.copy_(weight)
+    # The LoRA deltas are now part of the base weights, so the adapter branches must not run.
+    pipeline.disable_lora()
+    state.active_fused = key
+
+
+def apply_lora(
+    pipeline: Any, state: LoraState, lora: List[LoraAdapter] | None, fuse: bool
+) -> None:
+    """
+    Makes `lora` the active set of adapters on `pipeline`.
+    Loaded adapters are kept around (up to `MAX_LOADED_ADAPTERS`), so switching between them
+    only costs a `set_adapters` call rather than a full reload.
+    With `fuse`, the adapters are merged into the base weights for faster inference,
+    and the merged weights are cached so switching back to a hot combination is a copy.
+    """
+    names = [adapter_name(adapter) for adapter in lora or []]
+    weights = [adapter.weight for adapter in lora or []]
+    key: FusedKey = tuple(zip(names, weights))
+    if state.active_fused is not None and (not fuse or state.active_fused != key):
+        _restore_base(pipeline, state)
+    if not lora:
+        if state.loaded:
+            pipeline.disable_lora()
+        return
+    for name, adapter in zip(names, lora):
+        if name in state.loaded:
+            state.loaded.move_to_end(name)
+            continue
+        while len(state.loaded) >= MAX_LOADED_ADAPTERS:
+            evicted = next(
+                (loaded for loaded in state.loaded if loaded not in names), None
+            )
+            if evicted is None:
+                break
+            del state.loaded[evicted]
+            pipeline.delete_adapters(evicted)
+        pipeline.load_lora_weights(
+            adapter.id, weight_name=adapter.weight_name, adapter_name=name
+        )
+        state.loaded[name] = adapter
+    if fuse and state.active_fused == key:
+        return
+    pipeline.enable_lora()
+    pipeline.set_adapters(names, adapter_weights=weights)
+    if fuse:
+        _fuse(pipeline, state, names, key)
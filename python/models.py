@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+from typing import Dict, List
+
+from fastmcp import FastMCP
+from pydantic import BaseModel, TypeAdapter
+
+from .component_pool import component_pool
+from .pipelines import (
+    TEXT_TO_IMAGE_PIPELINES,
+    PipelineFamily,
+    ResidentModel,
+    find_resident_models,
+    resident_model,
+    resident_models,
+    unload_model as unload_resident_model,
+    warm_up,
+)
+from .quantization import Quantization
+
+mcp = FastMCP("models")
+models_mcp = mcp
+
+
+class PreloadEntry(BaseModel):
+    model_id_or_path: str
+    family: PipelineFamily
+    quantization: Quantization | None = None
+    pin: bool = True
+    warmup: bool = True
+
+
+class ResidentModelInfo(BaseModel):
+    model_id_or_path: str
+    torch_dtype: str
+    quantization: Quantization | None
+    pinned: bool
+    pipelines: List[str]
+    footprint_bytes: int
+    component_bytes: Dict[str, int]
+    shared_components: List[str]
+    """Components that are stored once and shared with other resident models."""
+    unique_bytes: int
+    """Bytes that would be freed by unloading this model."""
+
+
+class ResidentMemory(BaseModel):
+    resident_bytes: int
+    """Bytes taken up by all resident models, counting shared components once."""
+    saved_bytes: int
+    """Bytes saved by sharing identical components between models."""
+
+
+class Readiness(BaseModel):
+    ready: bool = False
+    """Whether preloading and warmup have finished."""
+    loaded: List[str] = []
+    error: str | None = None
+
+
+readiness = Readiness()
+
+
+def _info(model: ResidentModel) -> ResidentModelInfo:
+    footprint = model.footprint()
+    shared = model.shared_with_others()
+    return ResidentModelInfo(
+        model_id_or_path=model.model_id_or_path,
+        torch_dtype=str(model.torch_dtype),
+        quantization=model.quantization,
+        pinned=model.pinned,
+        pipelines=[pipeline_class.__name__ for pipeline_class in model.pipelines],
+        footprint_bytes=sum(footprint.values()),
+        component_bytes=footprint,
+        shared_components=shared,
+        unique_bytes=sum(
+            size for name, size in footprint.items() if name not in shared
+        ),
+    )
+
+
+def _load(entry: PreloadEntry) -> ResidentModel:
+    pipeline_class, torch_dtype = TEXT_TO_IMAGE_PIPELINES[entry.family]
+    model = resident_model(
+        pipeline_class, entry.model_id_or_path, torch_dtype, entry.quantization
+    )
+    model.pinned = model.pinned or entry.pin
+    if entry.warmup:
+        with model.lock:
+            warm_up(model.pipeline(pipeline_class))
+    return model
+
+
+def preload(entries: List[PreloadEntry]) -> None:
+    """Loads and warms up `entries` in order, then marks the server as ready."""
+    try:
+        for entry in entries:
+            _load(entry)
+            readiness.loaded.append(entry.model_id_or_path)
+        readiness.ready = True
+    except Exception as error:
+        readiness.error = repr(error)
+        raise
+
+
+def start_preload() -> threading.Thread:
+    """
+    Preloads the models listed in `MAKI_PRELOAD` in the background.
+    `MAKI_PRELOAD` is either a JSON list of `PreloadEntry`s, or a path to a file containing one.
+    """
+    config = os.environ.get("MAKI_PRELOAD", "[]")
+    if not config.lstrip().startswith("["):
+        with open(config) as file:
+            config = file.read()
+    entries = TypeAdapter(List[PreloadEntry]).validate_python(json.loads(config))
+    thread = threading.Thread(
+        target=preload, args=(entries,), name="maki-preload", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+@mcp.tool
+def list_models() -> List[ResidentModelInfo]:
+    """List the models that are currently resident, with their memory footprints"""
+    return [_info(model) for model in list(resident_models.values())]
+
+
+@mcp.tool
+def resident_memory() -> ResidentMemory:
+    """Get the memory taken up by all resident models, accounting for shared components"""
+    models = list(resident_models.values())
+    unpooled = sum(
+        size
+        for model in models
+        for name, size in model.footprint().items()
+        if name not in model.shared
+    )
+    naive = sum(sum(model.footprint().values()) for model in models)
+    resident = unpooled + component_pool.total_bytes()
+    return ResidentMemory(resident_bytes=resident, saved_bytes=naive - resident)
+
+
+@mcp.tool
+def load_model(
+    model_id_or_path: str,
+    family: PipelineFamily,
+    quantization: Quantization | None = None,
+    pin: bool = False,
+    warmup: bool = True,
+) -> ResidentModelInfo:
+    """Load a model ahead of time, optionally pinning it so it is never evicted"""
+    entry = PreloadEntry(
+        model_id_or_path=model_id_or_path,
+        family=family,
+        quantization=quantization,
+        pin=pin,
+        warmup=warmup,
+    )
+    return _info(_load(entry))
+
+
+@mcp.tool
+def unload_model(model_id_or_path: str) -> int:
+    """Unload every resident variant of a model. Returns how many were unloaded"""
+    return unload_resident_model(model_id_or_path)
+
+
+@mcp.tool
+def pin_model(model_id_or_path: str, pinned: bool = True) -> List[ResidentModelInfo]:
+    """Pin (or unpin) every resident variant of a model"""
+    models = find_resident_models(model_id_or_path)
+    for model in models:
+        model.pinned = pinned
+    return [_info(model) for model in models]
+
+
+if __name__ == "__main__":
+    mcp.run()
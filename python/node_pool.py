@@ -0,0 +1,276 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncGenerator, Callable, Dict, List
+
+import mcp.types
+from fastmcp.client import Client
+from fastmcp.client.elicitation import ElicitResult
+from fastmcp.client.logging import LogMessage, default_log_handler
+from fastmcp.client.transports import StdioTransport
+from fastmcp.exceptions import NotFoundError, ToolError
+from fastmcp.server.context import Context
+from fastmcp.server.dependencies import get_context
+from fastmcp.server.proxy import FastMCPProxy
+from fastmcp.tools.tool import Tool, ToolResult
+from fastmcp.tools.tool_manager import ToolManager
+from fastmcp.tools.tool_transform import apply_transformations_to_tools
+from fastmcp.utilities.components import MirroredComponent
+
+# How many Node MCP server processes to spread tool calls over.
+NODE_WORKERS = int(os.environ.get("MAKI_NODE_WORKERS", "4"))
+NODE_SERVER = Path(__file__).parent.parent / "src" / "server.ts"
+
+
+def node_transport() -> StdioTransport:
+    # Assumes you have `node` installed with native TypeScript support (Node 20+).
+    return StdioTransport(command="node", args=[str(NODE_SERVER)])
+
+
+class NodeWorker:
+    """
+    One Node MCP server process and its session. The session outlives the requests that use
+    it, so log messages and elicitations from Node are routed to the request they belong to
+    rather than to whatever context is current when they arrive.
+    """
+
+    def __init__(self, transport: StdioTransport) -> None:
+        self.client = Client(
+            transport, log_handler=self._log, elicitation_handler=self._elicit
+        )
+        self.in_flight = 0
+        self.connect_lock = asyncio.Lock()
+        self.requests: List[Context] = []
+        """Contexts of the tool calls in flight on this worker."""
+
+    def _requester(self) -> Context | None:
+        """
+        The request that a log message or elicitation from Node belongs to. Neither carries
+        a request id over stdio, so they can only be attributed while a single call is in flight.
+        """
+        if self.in_flight != 1 or len(self.requests) != 1:
+            return None
+        return self.requests[0]
+
+    async def _log(self, message: LogMessage) -> None:
+        context = self._requester()
+        if context is None:
+            await default_log_handler(message)
+            return
+        await context.log(
+            str(message.data), level=message.level, logger_name=message.logger
+        )
+
+    async def _elicit(
+        self,
+        message: str,
+        response_type: type,
+        params: mcp.types.ElicitRequestParams,
+        context: Any,
+    ) -> ElicitResult[Any]:
+        requester = self._requester()
+        if requester is None:
+            # Asking the wrong client would be worse than not asking.
+            return ElicitResult(action="decline")
+        result = await requester.session.elicit(
+            message=message,
+            requestedSchema=params.requestedSchema,
+            related_request_id=requester.request_id,
+        )
+        return ElicitResult(action=result.action, content=result.content)
+
+
+class NodeWorkerPool:
+    """
+    Node MCP server processes, each with one long-lived session.
+    Every call goes to the worker with the fewest calls in flight. Responses are matched to
+    requests by id, so calls to the same worker share its pipe instead of queueing behind
+    each other. The Node tools are registered at startup, so their list is fetched once.
+    """
+
+    def __init__(
+        self, size: int, transport: Callable[[], StdioTransport] = node_transport
+    ) -> None:
+        if size < 1:
+            raise ValueError("A Node worker pool needs at least one worker")
+        self.workers = [NodeWorker(transport()) for _ in range(size)]
+        self._tools: Dict[str, mcp.types.Tool] | None = None
+        self._tools_lock = asyncio.Lock()
+
+    async def _connect(self, worker: NodeWorker) -> None:
+        """(Re)starts the worker's session if it is not running, e.g. because Node exited."""
+        if worker.client.is_connected():
+            return
+        async with worker.connect_lock:
+            if worker.client.is_connected():
+                return
+            # Resets the session state of a worker whose process died.
+            await worker.client.close()
+            await worker.client.__aenter__()
+
+    @asynccontextmanager
+    async def worker(self) -> AsyncGenerator[NodeWorker]:
+        """The least busy worker, connected and counted as busy for the block."""
+        worker = min(self.workers, key=lambda worker: worker.in_flight)
+        worker.in_flight += 1
+        try:
+            await self._connect(worker)
+            yield worker
+        finally:
+            worker.in_flight -= 1
+
+    @asynccontextmanager
+    async def client(self) -> AsyncGenerator[Client[StdioTransport]]:
+        """A connected client for the least busy worker, counted as busy for the block."""
+        async with self.worker() as worker:
+            yield worker.client
+
+    async def any_client(self) -> Client[StdioTransport]:
+        """A connected client, for the rarely used resource and prompt requests."""
+        async with self.client() as client:
+            return client
+
+    async def start(self) -> None:
+        """Starts every worker at once, rather than as load first reaches it."""
+        await asyncio.gather(*(self._connect(worker) for worker in self.workers))
+
+    async def tools(self) -> Dict[str, mcp.types.Tool]:
+        if self._tools is None:
+            async with self._tools_lock:
+                if self._tools is None:
+                    await self.start()
+                    async with self.client() as client:
+                        self._tools = {
+                            tool.name: tool for tool in await client.list_tools()
+                        }
+        return self._tools
+
+    def invalidate_tools(self) -> None:
+        self._tools = None
+
+    async def call_tool(
+        self, name: str, arguments: Dict[str, Any], context: Context | None = None
+    ) -> mcp.types.CallToolResult:
+        """
+        Calls a Node tool on the least busy worker. Progress, log messages and elicitations
+        from the call are forwarded to `context`, the request that made it.
+        """
+        if name not in await self.tools():
+            raise NotFoundError(f"Tool {name!r} not found")
+        async with self.worker() as worker:
+            if context is None:
+                return await worker.client.call_tool_mcp(name=name, arguments=arguments)
+            worker.requests.append(context)
+            try:
+                return await worker.client.call_tool_mcp(
+                    name=name,
+                    arguments=arguments,
+                    # Progress notifications carry the call's token, so they always route.
+                    progress_handler=context.report_progress,
+                )
+            finally:
+                worker.requests.remove(context)
+
+    async def close(self) -> None:
+        for worker in self.workers:
+            await worker.client.close()
+
+
+class PooledTool(Tool, MirroredComponent):
+    """A Node tool, called through whichever worker of the pool is least busy."""
+
+    def __init__(self, pool: NodeWorkerPool, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._pool = pool
+
+    @classmethod
+    def from_mcp_tool(cls, pool: NodeWorkerPool, tool: mcp.types.Tool) -> "PooledTool":
+        return cls(
+            pool=pool,
+            name=tool.name,
+            description=tool.description,
+            parameters=tool.inputSchema,
+            annotations=tool.annotations,
+            output_schema=tool.outputSchema,
+            meta=tool.meta,
+            tags=(tool.meta or {}).get("_fastmcp", {}).get("tags", []),
+            _mirrored=True,
+        )
+
+    async def run(
+        self, arguments: Dict[str, Any], context: Context | None = None
+    ) -> ToolResult:
+        if context is None:
+            # The tool manager does not pass the context, but this runs in the request's task.
+            try:
+                context = get_context()
+            except RuntimeError:
+                pass  # Not called from a request, e.g. from a benchmark.
+        result = await self._pool.call_tool(self.name, arguments, context)
+        if result.isError:
+            message = next(
+                (
+                    content.text
+                    for content in result.content
+                    if isinstance(content, mcp.types.TextContent)
+                ),
+                f"Tool {self.name!r} failed without a message",
+            )
+            raise ToolError(message)
+        return ToolResult(
+            content=result.content, structured_content=result.structuredContent
+        )
+
+
+class PooledToolManager(ToolManager):
+    """Like the proxy's tool manager, but listing tools from the pool's cache."""
+
+    def __init__(self, pool: NodeWorkerPool, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.pool = pool
+        self._pooled_tools: Dict[str, Tool] = {}
+        self._pooled_from: Dict[str, mcp.types.Tool] | None = None
+
+    async def _pooled(self) -> Dict[str, Tool]:
+        """The pool's tools, wrapped once per fetch of the tool list rather than per call."""
+        tools = await self.pool.tools()
+        if tools is not self._pooled_from:
+            self._pooled_tools = {
+                name: PooledTool.from_mcp_tool(self.pool, tool)
+                for name, tool in tools.items()
+            }
+            self._pooled_from = tools
+        return self._pooled_tools
+
+    async def get_tools(self) -> Dict[str, Tool]:
+        tools = await super().get_tools()
+        for name, tool in (await self._pooled()).items():
+            if name not in tools:
+                tools[name] = tool
+        return apply_transformations_to_tools(
+            tools=tools, transformations=self.transformations
+        )
+
+    async def list_tools(self) -> List[Tool]:
+        return list((await self.get_tools()).values())
+
+    async def call_tool(self, key: str, arguments: Dict[str, Any]) -> ToolResult:
+        try:
+            return await super().call_tool(key, arguments)
+        except NotFoundError:
+            return await (await self.get_tool(key)).run(arguments)
+
+
+class NodeProxy(FastMCPProxy):
+    """A proxy for the Node MCP server that spreads tool calls over a `NodeWorkerPool`."""
+
+    def __init__(self, pool: NodeWorkerPool, **settings: Any) -> None:
+        super().__init__(client_factory=pool.any_client, **settings)  # pyright: ignore[reportUnknownMemberType]
+        self.pool = pool
+        self._tool_manager = PooledToolManager(
+            pool, transformations=self._tool_manager.transformations
+        )
+
+
+node_pool = NodeWorkerPool(NODE_WORKERS)
@@ -0,0 +1,294 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Dict, Generator, List, Literal, Tuple
+
+import torch
+from torch.nn import Module
+from diffusers.pipelines.flux.pipeline_flux import FluxPipeline
+from diffusers.pipelines.pipeline_utils import DiffusionPipeline
+from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion import (
+    StableDiffusionPipeline,
+)
+from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion_img2img import (
+    StableDiffusionImg2ImgPipeline,
+)
+from diffusers.pipelines.stable_diffusion_3.pipeline_stable_diffusion_3 import (
+    StableDiffusion3Pipeline,
+)
+from diffusers.pipelines.stable_diffusion_3.pipeline_stable_diffusion_3_img2img import (
+    StableDiffusion3Img2ImgPipeline,
+)
+from diffusers.pipelines.stable_diffusion_xl.pipeline_stable_diffusion_xl import (
+    StableDiffusionXLPipeline,
+)
+from diffusers.pipelines.stable_diffusion_xl.pipeline_stable_diffusion_xl_img2img import (
+    StableDiffusionXLImg2ImgPipeline,
+)
+
+from .component_pool import SHARED_COMPONENTS, component_pool, fingerprint
+from .lora import LoraAdapter, LoraState, apply_lora
+from .quantization import (
+    QUANTIZED_COMPONENTS,
+    Quantization,
+    pipeline_footprint,
+    quantize_module,
+    quantize_pipeline,
+)
+
+# How many checkpoints may stay loaded at once. The least recently used one is evicted first.
+MAX_RESIDENT_MODELS = int(os.environ.get("MAKI_MAX_RESIDENT_MODELS", "2"))
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+type ModelKey = Tuple[str, torch.dtype, Quantization | None]
+
+type PipelineFamily = Literal[
+    "stable_diffusion", "stable_diffusion_xl", "stable_diffusion_3", "flux"
+]
+
+TEXT_TO_IMAGE_PIPELINES: Dict[
+    PipelineFamily, Tuple[type[DiffusionPipeline], torch.dtype]
+] = {
+    "stable_diffusion": (StableDiffusionPipeline, torch.float16),
+    "stable_diffusion_xl": (StableDiffusionXLPipeline, torch.float16),
+    "stable_diffusion_3": (StableDiffusion3Pipeline, torch.float16),
+    "flux": (FluxPipeline, torch.bfloat16),
+}
+
+IMAGE_TO_IMAGE_PIPELINES: Dict[PipelineFamily, type[DiffusionPipeline]] = {
+    "stable_diffusion": StableDiffusionImg2ImgPipeline,
+    "stable_diffusion_xl": StableDiffusionXLImg2ImgPipeline,
+    "stable_diffusion_3": StableDiffusion3Img2ImgPipeline,
+}
+
+
+class ResidentModel:
+    """
+    A checkpoint that is loaded on the device.
+    Every pipeline class requested for it is derived from the first one with `from_pipe`,
+    so e.g. text-to-image and image-to-image share the same weights.
+    """
+
+    def __init__(
+        self,
+        model_id_or_path: str,
+        torch_dtype: torch.dtype,
+        quantization: Quantization | None,
+        base: DiffusionPipeline,
+        shared: Dict[str, str],
+    ) -> None:
+        self.model_id_or_path = model_id_or_path
+        self.torch_dtype = torch_dtype
+        self.quantization: Quantization | None = quantization
+        self.shared = shared
+        """Pool keys of the components that live in the component pool."""
+        self.pipelines: Dict[type, DiffusionPipeline] = {type(base): base}
+        self.lora = LoraState()
+        self.pinned = False
+        """Pinned models are never evicted to make room for other models."""
+        self.lock = threading.Lock()
+        """
+        Held while one of the pipelines is in use. They share their scheduler, LoRA adapters and
+        cache hooks, and store per-call state such as the step index on themselves.
+        """
+
+    @property
+    def base(self) -> DiffusionPipeline:
+        return next(iter(self.pipelines.values()))
+
+    def footprint(self) -> Dict[str, int]:
+        """Bytes taken up by each component. Derived pipelines share these."""
+        return pipeline_footprint(self.base)
+
+    def shared_with_others(self) -> List[str]:
+        """Components that are also used by other resident models."""
+        return [
+            name
+            for name, key in self.shared.items()
+            if component_pool.refcount(key) > 1
+        ]
+
+    def unshare_text_encoders(self) -> None:
+        """
+        Takes the text encoders out of the component pool, since LoRA adapters modify them
+        in place. They are copied if another model still uses them.
+        """
+        for name, key in list(self.shared.items()):
+            if not name.startswith("text_encoder"):
+                continue
+            private = component_pool.withdraw(key)
+            for pipeline in self.pipelines.values():
+                setattr(pipeline, name, private)
+            del self.shared[name]
+
+    def release(self) -> None:
+        for key in self.shared.values():
+            component_pool.release(key)
+        self.shared = {}
+
+    def pipeline[P: DiffusionPipeline](self, pipeline_class: type[P]) -> P:
+        pipeline = self.pipelines.get(pipeline_class)
+        if pipeline is None:
+            pipeline = pipeline_class.from_pipe(self.base)  # pyright: ignore[reportUnknownMemberType]
+            self.pipelines[pipeline_class] = pipeline
+        return pipeline  # pyright: ignore[reportReturnType]
+
+
+resident_models: OrderedDict[ModelKey, ResidentModel] = OrderedDict()
+_lock = threading.Lock()
+"""Guards `resident_models` and `_loading`. Never held while loading a checkpoint."""
+_loading: Dict[ModelKey, threading.Lock] = {}
+"""Held while a checkpoint loads, so concurrent requests for it wait instead of loading it again."""
+
+
+def _release_memory() -> None:
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def _evict(keep: ModelKey) -> None:
+    evictable = [
+        key
+        for key, model in resident_models.items()
+        if not model.pinned and key != keep
+    ]
+    excess = len(resident_models) - MAX_RESIDENT_MODELS
+    for key in evictable[: max(excess, 0)]:
+        resident_models.pop(key).release()
+    _release_memory()
+
+
+def _share_components(
+    pipeline: DiffusionPipeline, quantization: Quantization | None
+) -> Dict[str, str]:
+    """
+    Replaces components with identical ones that are already resident, and adds the others
+    to the pool. Returns the pool key of each pooled component.
+    """
+    shared: Dict[str, str] = {}
+    for name in SHARED_COMPONENTS:
+        component = getattr(pipeline, name, None)
+        if not isinstance(component, Module):
+            continue
+        key = fingerprint(component, name, quantization)
+        pooled = component_pool.acquire(key)
+        if pooled is None:
+            if quantization is not None and name in QUANTIZED_COMPONENTS:
+                quantize_module(component, quantization)
+            # Another checkpoint may have pooled the same component in the meantime.
+            pooled = component_pool.add(key, component.to(DEVICE))
+        setattr(pipeline, name, pooled)
+        shared[name] = key
+    return shared
+
+
+def _cached_model(key: ModelKey) -> ResidentModel | None:
+    with _lock:
+        model = resident_models.get(key)
+        if model is not None:
+            resident_models.move_to_end(key)
+        return model
+
+
+def resident_model(
+    pipeline_class: type[DiffusionPipeline],
+    model_id_or_path: str,
+    torch_dtype: torch.dtype,
+    quantization: Quantization | None = None,
+) -> ResidentModel:
+    """Returns the resident model for a checkpoint, loading it with `pipeline_class` if needed."""
+    key: ModelKey = (model_id_or_path, torch_dtype, quantization)
+    model = _cached_model(key)
+    if model is not None:
+        return model
+    with _lock:
+        loading = _loading.setdefault(key, threading.Lock())
+    with loading:
+        # Loaded by whoever held the lock before.
+        model = _cached_model(key)
+        if model is not None:
+            return model
+        base: DiffusionPipeline = pipeline_class.from_pretrained(  # pyright: ignore[reportUnknownMemberType]
+            model_id_or_path, torch_dtype=torch_dtype
+        )
+        # Loaded on the CPU, so duplicate components never need to fit on the device.
+        shared = _share_components(base, quantization)
+        if quantization is not None:
+            # Likewise, quantize before moving to the device.
+            quantize_pipeline(base, quantization)
+        base = base.to(DEVICE)  # pyright: ignore[reportUnknownMemberType]
+        model = ResidentModel(model_id_or_path, torch_dtype, quantization, base, shared)
+        with _lock:
+            resident_models[key] = model
+            # Later requests find the model. One that failed to load keeps its lock, so retries
+            # still take turns.
+            _loading.pop(key, None)
+            _evict(key)
+        return model
+
+
+@contextmanager
+def load_pipeline[P: DiffusionPipeline](
+    pipeline_class: type[P],
+    model_id_or_path: str,
+    torch_dtype: torch.dtype,
+    lora: List[LoraAdapter] | None = None,
+    fuse_lora: bool = False,
+    quantization: Quantization | None = None,
+) -> Generator[P]:
+    """
+    Yields a `pipeline_class` for the checkpoint, reusing the resident weights if possible,
+    with exactly the adapters in `lora` active.
+    The checkpoint is locked for the block, so call the pipeline inside it. A staged decode only
+    needs the VAE, so run it after the block and let the next call on the checkpoint start.
+    """
+    if lora and quantization is not None:
+        # `peft` only knows how to wrap regular `Linear` layers.
+        raise ValueError("LoRA adapters cannot be applied to quantized models")
+    model = resident_model(pipeline_class, model_id_or_path, torch_dtype, quantization)
+    with model.lock:
+        pipeline = model.pipeline(pipeline_class)
+        if lora:
+            model.unshare_text_encoders()
+        pipeline_any: Any = pipeline
+        apply_lora(pipeline_any, model.lora, lora, fuse_lora)
+        yield pipeline
+
+
+def unload_model(model_id_or_path: str) -> int:
+    """Unloads every resident variant of a checkpoint, pinned or not. Returns the count."""
+    with _lock:
+        keys = [key for key in resident_models if key[0] == model_id_or_path]
+        for key in keys:
+            resident_models.pop(key).release()
+    _release_memory()
+    return len(keys)
+
+
+def find_resident_models(model_id_or_path: str) -> List[ResidentModel]:
+    with _lock:
+        return [
+            model
+            for key, model in resident_models.items()
+            if key[0] == model_id_or_path
+        ]
+
+
+def locked_vae(pipeline: Any, used: bool = True) -> ContextManager[Any]:
+    """
+    Holds the lock of the pipeline's VAE for the block, if it is `used`. The VAE may be pooled
+    with other resident models, and SDXL casts it to float32 and back around each use.
+    """
+    if not used:
+        return nullcontext()
+    return component_pool.lock(pipeline.vae)
+
+
+def warm_up(pipeline: Any) -> None:
+    """
+    Runs a tiny generation so that lazy initialization (CUDA context, kernel selection,
+    allocator growth) is not paid for by the first real request.
+    """
+    with locked_vae(pipeline):
+        pipeline(prompt="", num_inference_steps=2)
@@ -17,10 +17,10 @@ def custom_pydantic_annotation(json_schema: JsonSchemaValue) -> type:
         @classmethod
         def __get_pydantic_core_schema__(
             cls,
-            _source_type: Any,
+            source_type: Any,
             _handler: GetCoreSchemaHandler,
         ) -> core_schema.CoreSchema:
-            return core_schema.is_instance_schema(cls)
+            return core_schema.is_instance_schema(source_type)
 
         @classmethod
         def __get_pydantic_json_schema__(
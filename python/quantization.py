@@ -0,0 +1,112 @@
+import math
+from typing import Any, Dict, Literal
+
+import numpy
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+from torch.nn import Linear, Module, Parameter
+from PIL.Image import Image
+
+type Quantization = Literal["int8", "fp8"]
+
+# Components whose linear layers get quantized. The VAE is left alone, it is small and
+# conv-heavy, and is the most sensitive to precision loss.
+QUANTIZED_COMPONENTS = (
+    "unet",
+    "transformer",
+    "text_encoder",
+    "text_encoder_2",
+    "text_encoder_3",
+)
+
+
+def _storage_dtype(quantization: Quantization) -> torch.dtype:
+    if quantization == "int8":
+        return torch.int8
+    fp8: torch.dtype | None = getattr(torch, "float8_e4m3fn", None)
+    if fp8 is None:
+        raise ValueError("fp8 quantization is not supported by this version of torch")
+    return fp8
+
+
+class WeightOnlyLinear(Module):
+    """
+    A `Linear` layer whose weight is stored in 8 bits, with one scale per output channel.
+    The weight is dequantized on the fly, so activations stay in the original precision.
+    Plain torch, so it works on any device, including the CPU.
+    """
+
+    def __init__(self, linear: Linear, quantization: Quantization) -> None:
+        super().__init__()  # pyright: ignore[reportUnknownMemberType]
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features
+        storage_dtype = _storage_dtype(quantization)
+        weight = linear.weight.detach().float()
+        max_value = 127 if quantization == "int8" else torch.finfo(storage_dtype).max
+        scale = (weight.abs().amax(dim=1, keepdim=True) / max_value).clamp(min=1e-12)
+        quantized = weight / scale
+        if quantization == "int8":
+            quantized = quantized.round().clamp(-127, 127)
+        self.register_buffer("quantized_weight", quantized.to(storage_dtype))
+        self.register_buffer("scale", scale.to(linear.weight.dtype))
+        self.bias: Parameter | None = linear.bias
+
+    @property
+    def weight(self) -> Tensor:
+        """The dequantized weight, for code that reads `.weight` directly."""
+        quantized = self.get_buffer("quantized_weight")
+        scale = self.get_buffer("scale")
+        return quantized.to(scale.dtype) * scale
+
+    def forward(self, input: Tensor) -> Tensor:
+        quantized = self.get_buffer("quantized_weight")
+        scale = self.get_buffer("scale")
+        weight = quantized.to(input.dtype) * scale.to(input.dtype)
+        return F.linear(input, weight, self.bias)
+
+    def extra_repr(self) -> str:
+        return f"in_features={self.in_features}, out_features={self.out_features}, bias={self.bias is not None}"
+
+
+@torch.no_grad()  # pyright: ignore[reportUntypedFunctionDecorator]
+def quantize_module(module: Module, quantization: Quantization) -> None:
+    """Replaces every `Linear` in `module` (recursively) with a `WeightOnlyLinear`."""
+    for name, child in module.named_children():
+        if isinstance(child, Linear):
+            setattr(module, name, WeightOnlyLinear(child, quantization))
+        else:
+            quantize_module(child, quantization)
+
+
+def quantize_pipeline(pipeline: Any, quantization: Quantization) -> None:
+    for name in QUANTIZED_COMPONENTS:
+        component = getattr(pipeline, name, None)
+        if isinstance(component, Module):
+            quantize_module(component, quantization)
+
+
+def module_bytes(module: Module) -> int:
+    """Bytes taken up by the parameters and buffers of `module`."""
+    tensors = [*module.parameters(), *module.buffers()]
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+def pipeline_footprint(pipeline: Any) -> Dict[str, int]:
+    """Bytes taken up by each module of the pipeline."""
+    components: Dict[str, Any] = pipeline.components
+    return {
+        name: module_bytes(component)
+        for name, component in components.items()
+        if isinstance(component, Module)
+    }
+
+
+def image_psnr(image: Image, reference: Image) -> float:
+    """Peak signal-to-noise ratio of `image` against `reference`, in decibels."""
+    actual = numpy.asarray(image.convert("RGB"), dtype=numpy.float64)
+    expected = numpy.asarray(reference.convert("RGB"), dtype=numpy.float64)
+    mse = float(numpy.mean((actual - expected) ** 2))
+    if mse == 0:
+        return float("inf")
+    return 10 * math.log10(255**2 / mse)
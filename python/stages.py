@@ -0,0 +1,339 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, ContextManager, Dict, Generator, List, Literal
+
+import torch
+from diffusers.models.autoencoders.autoencoder_asym_kl import AsymmetricAutoencoderKL
+from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion import (
+    StableDiffusionPipeline,
+)
+from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion_img2img import (
+    StableDiffusionImg2ImgPipeline,
+)
+from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion_inpaint import (
+    StableDiffusionInpaintPipeline,
+)
+from diffusers.pipelines.stable_diffusion_3.pipeline_stable_diffusion_3 import (
+    StableDiffusion3Pipeline,
+)
+from diffusers.pipelines.stable_diffusion_3.pipeline_stable_diffusion_3_img2img import (
+    StableDiffusion3Img2ImgPipeline,
+)
+from diffusers.pipelines.stable_diffusion_3.pipeline_stable_diffusion_3_inpaint import (
+    StableDiffusion3InpaintPipeline,
+)
+from diffusers.pipelines.stable_diffusion_xl.pipeline_stable_diffusion_xl import (
+    StableDiffusionXLPipeline,
+)
+from diffusers.pipelines.stable_diffusion_xl.pipeline_stable_diffusion_xl_img2img import (
+    StableDiffusionXLImg2ImgPipeline,
+)
+from diffusers.pipelines.stable_diffusion_xl.pipeline_stable_diffusion_xl_inpaint import (
+    StableDiffusionXLInpaintPipeline,
+)
+from PIL.Image import Image
+from pydantic import BaseModel
+from torch import Tensor
+
+from .pipelines import locked_vae
+
+type Stage = Literal["denoise", "decode"]
+
+STABLE_DIFFUSION_PIPELINES = (
+    StableDiffusionPipeline,
+    StableDiffusionImg2ImgPipeline,
+    StableDiffusionInpaintPipeline,
+)
+STABLE_DIFFUSION_XL_PIPELINES = (
+    StableDiffusionXLPipeline,
+    StableDiffusionXLImg2ImgPipeline,
+    StableDiffusionXLInpaintPipeline,
+)
+STABLE_DIFFUSION_3_PIPELINES = (
+    StableDiffusion3Pipeline,
+    StableDiffusion3Img2ImgPipeline,
+    StableDiffusion3InpaintPipeline,
+)
+
+
+class StageStats(BaseModel):
+    pipelined: bool
+    """Whether a job may start denoising while the previous one is still decoding."""
+    jobs: int
+    elapsed: float
+    """Seconds since the worker started."""
+    denoise_busy: float
+    """Seconds spent loading, encoding prompts and denoising."""
+    decode_busy: float
+    """Seconds spent on the VAE decode, PIL conversion and storing results."""
+    overlap: float
+    """Seconds during which both stages were busy at once."""
+
+
+class Occupancy:
+    """Accumulates how long each stage is busy, and how long both are busy at the same time."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._started = self._last = time.monotonic()
+        self._active: Dict[Stage, int] = {"denoise": 0, "decode": 0}
+        self._busy: Dict[Stage, float] = {"denoise": 0, "decode": 0}
+        self._overlap = 0.0
+        self._jobs = 0
+
+    def _advance(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        for stage, active in self._active.items():
+            if active:
+                self._busy[stage] += elapsed
+        if all(self._active.values()):
+            self._overlap += elapsed
+
+    def move(self, leave: Stage | None, enter: Stage | None) -> None:
+        with self._lock:
+            self._advance()
+            if leave is not None:
+                self._active[leave] -= 1
+            if enter is not None:
+                self._active[enter] += 1
+            elif leave is not None:
+                self._jobs += 1
+
+    def stats(self, pipelined: bool) -> StageStats:
+        with self._lock:
+            self._advance()
+            return StageStats(
+                pipelined=pipelined,
+                jobs=self._jobs,
+                elapsed=self._last - self._started,
+                denoise_busy=self._busy["denoise"],
+                decode_busy=self._busy["decode"],
+                overlap=self._overlap,
+            )
+
+
+class JobStages:
+    """
+    Splits each job into a denoise stage and a decode stage (VAE decode, PIL conversion and
+    storing the result).
+    Only one job denoises at a time. When `pipelined`, a second worker thread starts
+    denoising the next job as soon as the current one reaches its decode stage, and the decode
+    runs on its own CUDA stream so the two overlap on the device.
+    """
+
+    def __init__(self, pipelined: bool) -> None:
+        self.pipelined = pipelined
+        self.occupancy = Occupancy()
+        self._denoise = threading.Lock()
+        # Serializes use of the VAE: SDXL casts it to float32 and back around every decode,
+        # and image-to-image and inpainting encode their input with it before denoising.
+        self._vae = threading.RLock()
+        self._streams = threading.local()
+
+    @property
+    def threads(self) -> int:
+        return 2 if self.pipelined else 1
+
+    def _stream(self) -> torch.cuda.Stream | None:
+        """Each worker thread decodes on its own stream."""
+        if not torch.cuda.is_available():
+            return None
+        stream: torch.cuda.Stream | None = getattr(self._streams, "stream", None)
+        if stream is None:
+            stream = torch.cuda.Stream()
+            self._streams.stream = stream
+        return stream
+
+    @contextmanager
+    def job(self) -> Generator["JobStage"]:
+        """
+        Waits for the denoise stage to be free. Take a job from the queue inside the block,
+        and call `JobStage.start` once there is one.
+        """
+        self._denoise.acquire()
+        stage = JobStage(self.occupancy, self._denoise, self._vae, self._stream())
+        token = _job_stage.set(stage)
+        try:
+            yield stage
+        finally:
+            _job_stage.reset(token)
+            stage.end()
+
+
+class JobStage:
+    """The stage a single job is in, as seen from the tool that runs it."""
+
+    def __init__(
+        self,
+        occupancy: Occupancy,
+        denoise: threading.Lock,
+        vae: threading.RLock,
+        stream: torch.cuda.Stream | None,
+    ) -> None:
+        self._occupancy = occupancy
+        self._denoise: threading.Lock | None = denoise
+        """Held until the job reaches its decode stage."""
+        self._vae = vae
+        self._holds_vae = False
+        self._stream = stream
+        self._stage: Stage | None = None
+
+    def start(self, encodes_images: bool) -> None:
+        if encodes_images:
+            self.hold_vae()
+        self._occupancy.move(None, "denoise")
+        self._stage = "denoise"
+
+    def hold_vae(self) -> None:
+        """Keeps other jobs from using the VAE until this one is decoded."""
+        if not self._holds_vae:
+            self._vae.acquire()
+            self._holds_vae = True
+
+    def _release_denoise(self) -> None:
+        if self._denoise is not None:
+            self._denoise.release()
+            self._denoise = None
+
+    @contextmanager
+    def decoding(self) -> Generator[None]:
+        """
+        Moves the job to the decode stage, letting the next job start denoising.
+        The block holds the VAE and runs on this worker's decode stream.
+        """
+        # Taken before the denoise stage is released, so the next job cannot get in between.
+        self._vae.acquire()
+        if self._holds_vae:
+            self._vae.release()
+        self._holds_vae = True
+        self._occupancy.move(self._stage, "decode")
+        self._stage = "decode"
+        self._release_denoise()
+        context: ContextManager[Any] = nullcontext()
+        if self._stream is not None:
+            self._stream.wait_stream(torch.cuda.current_stream())  # pyright: ignore[reportUnknownMemberType]
+            context = torch.cuda.stream(self._stream)
+        try:
+            with context:
+                yield
+        finally:
+            self._holds_vae = False
+            self._vae.release()
+
+    def end(self) -> None:
+        if self._holds_vae:
+            self._holds_vae = False
+            self._vae.release()
+        self._release_denoise()
+        if self._stage is not None:
+            self._occupancy.move(self._stage, None)
+
+
+_job_stage: ContextVar[JobStage | None] = ContextVar("job_stage", default=None)
+
+
+def _decode_stable_diffusion(pipeline: Any, latents: Tensor, generator: Any) -> Any:
+    vae = pipeline.vae
+    # What `encode_prompt` cast the prompt embeddings to, which the safety checker follows.
+    text_encoder = pipeline.text_encoder
+    prompt_dtype = (
+        text_encoder.dtype if text_encoder is not None else pipeline.unet.dtype
+    )
+    image = vae.decode(
+        latents / vae.config.scaling_factor, return_dict=False, generator=generator
+    )[0]
+    image, has_nsfw_concept = pipeline.run_safety_checker(
+        image, pipeline._execution_device, prompt_dtype
+    )
+    if has_nsfw_concept is None:
+        do_denormalize = [True] * image.shape[0]
+    else:
+        do_denormalize = [not has_nsfw for has_nsfw in has_nsfw_concept]
+    return pipeline.image_processor.postprocess(
+        image, output_type="pil", do_denormalize=do_denormalize
+    )
+
+
+def _decode_stable_diffusion_xl(pipeline: Any, latents: Tensor) -> Any:
+    vae = pipeline.vae
+    needs_upcast = vae.dtype == torch.float16 and vae.config.get("force_upcast", False)
+    if needs_upcast:
+        vae.to(dtype=torch.float32)
+        latents = latents.to(vae.dtype)
+    latents_mean = getattr(vae.config, "latents_mean", None)
+    latents_std = getattr(vae.config, "latents_std", None)
+    if latents_mean is not None and latents_std is not None:
+        mean = torch.tensor(latents_mean).view(1, 4, 1, 1).to(latents)
+        std = torch.tensor(latents_std).view(1, 4, 1, 1).to(latents)
+        latents = latents * std / vae.config.scaling_factor + mean
+    else:
+        latents = latents / vae.config.scaling_factor
+    try:
+        image = vae.decode(latents, return_dict=False)[0]
+    finally:
+        if needs_upcast:
+            vae.to(dtype=torch.float16)
+    if pipeline.watermark is not None:
+        image = pipeline.watermark.apply_watermark(image)
+    return pipeline.image_processor.postprocess(image, output_type="pil")
+
+
+def _decode_stable_diffusion_3(pipeline: Any, latents: Tensor) -> Any:
+    vae = pipeline.vae
+    latents = latents / vae.config.scaling_factor + vae.config.shift_factor
+    image = vae.decode(latents, return_dict=False)[0]
+    return pipeline.image_processor.postprocess(image, output_type="pil")
+
+
+class StagedDecode:
+    """
+    Defers the VAE decode of a tool call that runs in the job worker.
+    The pipeline is called with `output_type="latent"`, and its latents are then decoded
+    the same way the pipeline would have, but in the decode stage, so the next job can start
+    denoising meanwhile.
+    """
+
+    def __init__(self, stage: JobStage, pipeline: Any) -> None:
+        self._stage = stage
+        self._pipeline = pipeline
+
+    @staticmethod
+    def create(
+        pipeline: Any, output_type: str | None, padding_mask_crop: int | None = None
+    ) -> "StagedDecode | None":
+        """
+        Returns `None` outside the job worker, or when the pipeline decodes in a way that
+        cannot be done separately: non-PIL output, overlays for `padding_mask_crop`, or a VAE
+        that is conditioned on the input image.
+        """
+        stage = _job_stage.get()
+        if stage is None:
+            return None
+        if (
+            output_type != "pil"
+            or padding_mask_crop is not None
+            or isinstance(pipeline.vae, AsymmetricAutoencoderKL)
+        ):
+            # The pipeline decodes as part of the denoise stage, so keep the VAE to itself.
+            stage.hold_vae()
+            return None
+        return StagedDecode(stage, pipeline)
+
+    def decode(self, latents: Any, generator: Any = None) -> List[Image]:
+        if not isinstance(latents, Tensor):
+            raise ValueError("Expected the pipeline to return latents")
+        pipeline = self._pipeline
+        with self._stage.decoding(), locked_vae(pipeline), torch.no_grad():
+            if latents.is_cuda:
+                latents.record_stream(torch.cuda.current_stream())
+            if isinstance(pipeline, STABLE_DIFFUSION_PIPELINES):
+                return _decode_stable_diffusion(pipeline, latents, generator)
+            if isinstance(pipeline, STABLE_DIFFUSION_XL_PIPELINES):
+                return _decode_stable_diffusion_xl(pipeline, latents)
+            if isinstance(pipeline, STABLE_DIFFUSION_3_PIPELINES):
+                return _decode_stable_diffusion_3(pipeline, latents)
+            raise ValueError(f"Cannot decode latents for {type(pipeline).__name__}")
@@ -0,0 +1,194 @@
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Generator, List, Literal, Tuple
+
+from diffusers.hooks.first_block_cache import FirstBlockCacheConfig
+from diffusers.hooks.hooks import HookRegistry
+from diffusers.hooks.pyramid_attention_broadcast import (
+    _PYRAMID_ATTENTION_BROADCAST_HOOK,  # pyright: ignore[reportPrivateUsage]
+    PyramidAttentionBroadcastConfig,
+    apply_pyramid_attention_broadcast,
+)
+from pydantic import BaseModel
+from torch import Tensor
+from torch.nn import Module
+
+type StepCache = Literal["first_block", "pyramid_attention"]
+type BlockOutput = Tuple[Tensor | None, Tensor]
+"""`(encoder_hidden_states, hidden_states)`, as returned by SD3 and Flux transformer blocks."""
+type BlockForward = Callable[..., BlockOutput]
+
+
+class StepCacheStats(BaseModel):
+    mode: StepCache
+    unit: Literal["blocks", "attention"]
+    """What `computed` and `skipped` count: transformer blocks, or attention layers."""
+    transformer_calls: int
+    computed: int
+    skipped: int
+
+
+def _transformer_blocks(transformer: Module) -> List[Module]:
+    blocks: List[Module] = []
+    for name in ("transformer_blocks", "single_transformer_blocks"):
+        blocks.extend(getattr(transformer, name, None) or [])
+    return blocks
+
+
+def _attention_layers(transformer: Module) -> List[Module]:
+    return [module for module in transformer.modules() if hasattr(module, "processor")]
+
+
+def _count_calls(module: Module, counter: List[int]) -> None:
+    """
+    Counts calls to the *original* forward of `module`.
+    This must be installed before the cache hooks, which wrap whatever `forward` is current,
+    so that calls they skip are not counted.
+    """
+    forward: Callable[..., Any] = module.forward
+
+    def counted_forward(*args: Any, **kwargs: Any) -> Any:
+        counter[0] += 1
+        return forward(*args, **kwargs)
+
+    module.forward = counted_forward
+
+
+def _wrap_block(
+    block: Module, wrapper: Callable[[BlockForward, Dict[str, Any]], BlockOutput]
+) -> None:
+    """Routes calls to `block`, which are always made with keyword arguments, through `wrapper`."""
+    forward: BlockForward = block.forward
+
+    def wrapped_forward(**kwargs: Any) -> BlockOutput:
+        return wrapper(forward, kwargs)
+
+    block.forward = wrapped_forward
+
+
+class JointFirstBlockCache:
+    """
+    First block caching for transformers without diffusers' cache hooks, i.e. SD3.
+    Diffusers' version needs every block to return `encoder_hidden_states`, which the last
+    SD3 block does not, and a cache context per transformer call, which the SD3 pipelines do
+    not set. With classifier-free guidance, SD3 runs both halves in one call, so there is
+    one call per step.
+    """
+
+    def __init__(self, blocks: List[Module], threshold: float) -> None:
+        self.threshold = threshold
+        self._skip = False
+        self._head_residual: Tensor | None = None
+        self._head_output: Tensor | None = None
+        self._tail_residual: Tensor | None = None
+        head, *middle, tail = blocks
+        _wrap_block(head, self._head)
+        for block in middle:
+            _wrap_block(block, self._middle)
+        _wrap_block(tail, self._tail)
+
+    def _head(self, forward: BlockForward, kwargs: Dict[str, Any]) -> BlockOutput:
+        encoder_hidden_states, hidden_states = forward(**kwargs)
+        residual = hidden_states - kwargs["hidden_states"]
+        previous, tail_residual = self._head_residual, self._tail_residual
+        self._skip = (
+            previous is not None
+            and tail_residual is not None
+            and ((residual - previous).abs().mean() / previous.abs().mean()).item()
+            < self.threshold
+        )
+        if self._skip and tail_residual is not None:
+            return encoder_hidden_states, hidden_states + tail_residual
+        # Like diffusers, compares against the last step that was computed in full.
+        self._head_residual = residual
+        self._head_output = hidden_states
+        return encoder_hidden_states, hidden_states
+
+    def _middle(self, forward: BlockForward, kwargs: Dict[str, Any]) -> BlockOutput:
+        if self._skip:
+            return kwargs["encoder_hidden_states"], kwargs["hidden_states"]
+        return forward(**kwargs)
+
+    def _tail(self, forward: BlockForward, kwargs: Dict[str, Any]) -> BlockOutput:
+        if self._skip or self._head_output is None:
+            return self._middle(forward, kwargs)
+        encoder_hidden_states, hidden_states = forward(**kwargs)
+        self._tail_residual = hidden_states - self._head_output
+        return encoder_hidden_states, hidden_states
+
+
+@contextmanager
+def step_caching(
+    pipeline: Any, mode: StepCache | None, threshold: float, skip_range: int
+) -> Generator[StepCacheStats | None]:
+    """
+    Enables step caching on the pipeline's transformer for the duration of the block.
+    - `first_block`: when the residual of the first block changes by less than `threshold`
+      (relative) between steps, the remaining blocks reuse their residual from the last step.
+    - `pyramid_attention`: attention outputs are recomputed only every `skip_range` steps.
+    The returned stats are filled in when the block exits. With no `mode`, this does nothing.
+    Flux uses diffusers' cache hooks as they are; SD3 needs a first block cache of its own,
+    and its timestep taken from the transformer's inputs.
+    """
+    if mode is None:
+        yield None
+        return
+    transformer: Any = pipeline.transformer
+    units = (
+        _transformer_blocks(transformer)
+        if mode == "first_block"
+        else _attention_layers(transformer)
+    )
+    calls = [0]
+    computed = [0]
+    timestep = [0.0]
+    for unit in units:
+        _count_calls(unit, computed)
+
+    def pre_forward(_module: Module, _args: Any, kwargs: Dict[str, Any]) -> None:
+        calls[0] += 1
+        if "timestep" in kwargs:
+            timestep[0] = float(kwargs["timestep"].flatten()[0])
+
+    handle = transformer.register_forward_pre_hook(pre_forward, with_kwargs=True)
+    native = hasattr(transformer, "enable_cache")
+    if mode == "first_block" and native:
+        transformer.enable_cache(FirstBlockCacheConfig(threshold=threshold))
+    elif mode == "first_block":
+        JointFirstBlockCache(units, threshold)
+    else:
+        # Flux passes the transformer a timestep scaled to [0, 1], so use the pipeline's.
+        # Either is a float or a 0-d tensor, though diffusers annotates the callback as `int`.
+        current_timestep: Callable[[], Any] = (
+            (lambda: pipeline.current_timestep)
+            if hasattr(pipeline, "current_timestep")
+            else (lambda: timestep[0])
+        )
+        apply_pyramid_attention_broadcast(
+            transformer,
+            PyramidAttentionBroadcastConfig(
+                spatial_attention_block_skip_range=skip_range,
+                current_timestep_callback=current_timestep,
+            ),
+        )
+    stats = StepCacheStats(
+        mode=mode,
+        unit="blocks" if mode == "first_block" else "attention",
+        transformer_calls=0,
+        computed=0,
+        skipped=0,
+    )
+    try:
+        yield stats
+    finally:
+        if mode == "first_block" and native:
+            transformer.disable_cache()
+        elif mode == "pyramid_attention":
+            HookRegistry.check_if_exists_or_initialize(transformer).remove_hook(
+                _PYRAMID_ATTENTION_BROADCAST_HOOK, recurse=True
+            )
+        handle.remove()
+        for unit in units:
+            del unit.forward
+        stats.transformer_calls = calls[0]
+        stats.computed = computed[0]
+        stats.skipped = calls[0] * len(units) - computed[0]
@@ -0,0 +1,98 @@
+import itertools
+from typing import Any, Dict, Iterator, List, Tuple
+
+import torch
+from pydantic import BaseModel
+from torch import Tensor
+
+from .pipelines import PipelineFamily
+
+
+class SweepPoint(BaseModel):
+    seed: int
+    guidance_scale: float
+    strength: float | None = None
+
+
+def sweep_batches(
+    seeds: List[int],
+    guidance_scales: List[float],
+    strengths: List[float | None],
+    max_batch_size: int,
+) -> Iterator[List[SweepPoint]]:
+    """
+    Splits the grid into batches that can each be run with one pipeline call.
+    `guidance_scale` and `strength` are scalars in every pipeline, so only seeds vary in a batch.
+    """
+    for guidance_scale, strength in itertools.product(guidance_scales, strengths):
+        for start in range(0, len(seeds), max_batch_size):
+            yield [
+                SweepPoint(seed=seed, guidance_scale=guidance_scale, strength=strength)
+                for seed in seeds[start : start + max_batch_size]
+            ]
+
+
+def encode_prompt(
+    pipeline: Any,
+    family: PipelineFamily,
+    prompt: str,
+    negative_prompt: str | None,
+) -> Dict[str, Tensor]:
+    """
+    Encodes the prompt once, as keyword arguments for the pipeline.
+    Negative embeddings are always computed, since some points of the sweep may use guidance.
+    """
+    device = pipeline._execution_device
+    if family == "stable_diffusion":
+        prompt_embeds, negative_prompt_embeds = pipeline.encode_prompt(
+            prompt, device, 1, True, negative_prompt
+        )
+        return {
+            "prompt_embeds": prompt_embeds,
+            "negative_prompt_embeds": negative_prompt_embeds,
+        }
+    if family == "flux":
+        prompt_embeds, pooled_prompt_embeds, _text_ids = pipeline.encode_prompt(
+            prompt=prompt, prompt_2=None, device=device, num_images_per_prompt=1
+        )
+        return {
+            "prompt_embeds": prompt_embeds,
+            "pooled_prompt_embeds": pooled_prompt_embeds,
+        }
+    # SD3 has a third text encoder, and requires its extra prompts to be passed explicitly.
+    extra_prompts = (
+        {"prompt_2": None, "prompt_3": None} if family == "stable_diffusion_3" else {}
+    )
+    embeds: Tuple[Tensor, Tensor, Tensor, Tensor] = pipeline.encode_prompt(
+        prompt=prompt,
+        **extra_prompts,
+        device=device,
+        num_images_per_prompt=1,
+        do_classifier_free_guidance=True,
+        negative_prompt=negative_prompt,
+    )
+    return dict(
+        zip(
+            (
+                "prompt_embeds",
+                "negative_prompt_embeds",
+                "pooled_prompt_embeds",
+                "negative_pooled_prompt_embeds",
+            ),
+            embeds,
+        )
+    )
+
+
+def repeat_embeds(embeds: Dict[str, Tensor], batch_size: int) -> Dict[str, Tensor]:
+    return {
+        name: tensor.repeat(batch_size, *[1] * (tensor.dim() - 1))
+        for name, tensor in embeds.items()
+    }
+
+
+def generators(device: torch.device, batch: List[SweepPoint]) -> List[torch.Generator]:
+    """
+    One generator per sample, so each image matches a single-image call with the same seed.
+    """
+    return [torch.Generator(device).manual_seed(point.seed) for point in batch]
@@ -0,0 +1,235 @@
+from contextlib import contextmanager
+from typing import Any, Dict, Generator, Iterator, List, Literal, Tuple
+
+import torch
+from diffusers.utils.torch_utils import randn_tensor  # pyright: ignore[reportUnknownVariableType]
+from PIL.Image import Image, Resampling
+from torch import Tensor
+
+from .pipelines import locked_vae
+from .sweep import encode_prompt
+
+type TiledFamily = Literal["stable_diffusion", "stable_diffusion_xl"]
+type Tile = Tuple[int, int]
+"""`(top, left)` of a tile, in latent pixels."""
+
+
+def tile_starts(length: int, tile: int, stride: int) -> List[int]:
+    """Tile offsets covering `length`, with the last tile flush against the end."""
+    if length <= tile:
+        return [0]
+    return [*range(0, length - tile, stride), length - tile]
+
+
+def tile_weights(height: int, width: int, overlap: int, device: torch.device) -> Tensor:
+    """
+    Blending weights for one tile, ramping up linearly over `overlap` pixels from each edge,
+    so neighbouring tiles cross-fade instead of leaving seams.
+    """
+
+    def ramp(length: int) -> Tensor:
+        index = torch.arange(length, device=device, dtype=torch.float32)
+        # Distance from the nearest edge, counting the edge pixel itself as 1.
+        distance = torch.minimum(index, index.flip(0)) + 1
+        return (distance / (overlap + 1)).clamp(max=1)
+
+    return ramp(height)[:, None] * ramp(width)[None, :]
+
+
+def _batches(tiles: List[Tile], batch_size: int) -> Iterator[List[Tile]]:
+    for start in range(0, len(tiles), batch_size):
+        yield tiles[start : start + batch_size]
+
+
+def _sdxl_time_ids(
+    image_size: Tuple[int, int],
+    tiles: List[Tile],
+    tile_size: Tuple[int, int],
+    scale: int,
+) -> Tensor:
+    """
+    SDXL micro-conditioning for each tile: the full image is the original size,
+    the tile offset is the crop, and the tile itself is the target size.
+    """
+    return torch.tensor(
+        [
+            [
+                *image_size,
+                top * scale,
+                left * scale,
+                tile_size[0] * scale,
+                tile_size[1] * scale,
+            ]
+            for top, left in tiles
+        ],
+        dtype=torch.float32,
+    )
+
+
+@contextmanager
+def _tiled_vae(pipeline: Any) -> Generator[Any]:
+    """
+    Locks the pipeline's VAE and switches it to tiled encoding and decoding for the block,
+    upcasting it to float32 if its config asks for that. Both are undone on exit, before the
+    lock is released, so other pipelines sharing the VAE never see it changed.
+    """
+    vae = pipeline.vae
+    with locked_vae(pipeline):
+        needs_upcast = vae.dtype == torch.float16 and vae.config.get(
+            "force_upcast", False
+        )
+        vae.enable_tiling()
+        try:
+            if needs_upcast:
+                vae.to(dtype=torch.float32)
+            yield vae
+        finally:
+            vae.disable_tiling()
+            if needs_upcast:
+                vae.to(dtype=torch.float16)
+
+
+@torch.no_grad()  # pyright: ignore[reportUntypedFunctionDecorator]
+def tiled_image_to_image(
+    pipeline: Any,
+    family: TiledFamily,
+    image: Image,
+    prompt: str,
+    negative_prompt: str | None,
+    strength: float,
+    num_inference_steps: int,
+    guidance_scale: float,
+    tile_size: int,
+    tile_overlap: int,
+    tile_batch_size: int,
+    generator: torch.Generator,
+) -> Image:
+    """
+    Image-to-image over overlapping latent tiles (MultiDiffusion).
+    Every step, the noise prediction of each tile is computed in batches of `tile_batch_size`
+    and blended into one prediction for the whole latent, so memory is bounded by the tile
+    size while the result stays coherent across tiles.
+    `tile_size` and `tile_overlap` are in pixels.
+    """
+    device: torch.device = pipeline._execution_device
+    unet = pipeline.unet
+    scheduler = pipeline.scheduler
+    scale: int = pipeline.vae_scale_factor
+    do_cfg = guidance_scale > 1
+
+    embeds = encode_prompt(pipeline, family, prompt, negative_prompt)
+    with _tiled_vae(pipeline) as vae:
+        pixels = pipeline.image_processor.preprocess(image).to(device, vae.dtype)
+        latents = vae.encode(pixels).latent_dist.sample(generator)
+        latents = (latents * vae.config.scaling_factor).to(unet.dtype)
+
+    scheduler.set_timesteps(num_inference_steps, device=device)
+    timesteps, _ = pipeline.get_timesteps(num_inference_steps, strength, device)
+    noise = randn_tensor(
+        latents.shape, generator=generator, device=device, dtype=latents.dtype
+    )
+    latents = scheduler.add_noise(latents, noise, timesteps[:1])
+
+    _, _, height, width = latents.shape
+    tile = min(tile_size // scale, height), min(tile_size // scale, width)
+    # Tiles are cropped to small images, so keep at least one latent pixel of stride.
+    overlap = max(0, min(tile_overlap // scale, min(tile) - 1))
+    tiles: List[Tile] = [
+        (top, left)
+        for top in tile_starts(height, tile[0], tile[0] - overlap)
+        for left in tile_starts(width, tile[1], tile[1] - overlap)
+    ]
+    weights = tile_weights(*tile, overlap, device).to(latents.dtype)
+    weight_sum = torch.zeros((height, width), device=device, dtype=latents.dtype)
+    for top, left in tiles:
+        weight_sum[top : top + tile[0], left : left + tile[1]] += weights
+
+    for t in timesteps:
+        noise_pred = torch.zeros_like(latents)
+        for batch in _batches(tiles, tile_batch_size):
+            tile_latents = torch.cat(
+                [
+                    latents[:, :, top : top + tile[0], left : left + tile[1]]
+                    for top, left in batch
+                ]
+            )
+            model_input = scheduler.scale_model_input(tile_latents, t)
+            conditioning = _conditioning(
+                family, embeds, batch, (image.height, image.width), tile, scale
+            )
+            if do_cfg:
+                model_input = torch.cat([model_input, model_input])
+            else:
+                conditioning = {
+                    name: value.chunk(2)[1] for name, value in conditioning.items()
+                }
+            encoder_hidden_states = conditioning.pop("encoder_hidden_states")
+            prediction = unet(
+                model_input,
+                t,
+                encoder_hidden_states=encoder_hidden_states.to(device, unet.dtype),
+                added_cond_kwargs={
+                    name: value.to(device, unet.dtype)
+                    for name, value in conditioning.items()
+                }
+                or None,
+                return_dict=False,
+            )[0]
+            if do_cfg:
+                uncond, cond = prediction.chunk(2)
+                prediction = uncond + guidance_scale * (cond - uncond)
+            for (top, left), tile_prediction in zip(batch, prediction):
+                noise_pred[:, :, top : top + tile[0], left : left + tile[1]] += (
+                    tile_prediction * weights
+                )
+        noise_pred /= weight_sum
+        latents = scheduler.step(noise_pred, t, latents, return_dict=False)[0]
+
+    with _tiled_vae(pipeline) as vae:
+        decoded = vae.decode(
+            latents.to(vae.dtype) / vae.config.scaling_factor, return_dict=False
+        )[0]
+    output: List[Image] = pipeline.image_processor.postprocess(
+        decoded, output_type="pil"
+    )
+    return output[0]
+
+
+def _conditioning(
+    family: TiledFamily,
+    embeds: Dict[str, Tensor],
+    batch: List[Tile],
+    image_size: Tuple[int, int],
+    tile: Tuple[int, int],
+    scale: int,
+) -> Dict[str, Tensor]:
+    """Conditioning for a batch of tiles, unconditional first then conditional."""
+    count = len(batch)
+
+    def both(negative: Tensor, positive: Tensor) -> Tensor:
+        return torch.cat(
+            [
+                negative.repeat(count, *[1] * (negative.dim() - 1)),
+                positive.repeat(count, *[1] * (positive.dim() - 1)),
+            ]
+        )
+
+    conditioning = {
+        "encoder_hidden_states": both(
+            embeds["negative_prompt_embeds"], embeds["prompt_embeds"]
+        )
+    }
+    if family == "stable_diffusion_xl":
+        time_ids = _sdxl_time_ids(image_size, batch, tile, scale)
+        conditioning["text_embeds"] = both(
+            embeds["negative_pooled_prompt_embeds"], embeds["pooled_prompt_embeds"]
+        )
+        conditioning["time_ids"] = torch.cat([time_ids, time_ids])
+    return conditioning
+
+
+def upscale(image: Image, factor: float) -> Image:
+    """Resizes `image` by `factor`, rounded down to a multiple of 8 pixels."""
+    width = int(image.width * factor) // 8 * 8
+    height = int(image.height * factor) // 8 * 8
+    return image.convert("RGB").resize((width, height), Resampling.LANCZOS)